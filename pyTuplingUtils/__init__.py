@@ -2,14 +2,23 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Thu Jun 10, 2021 at 02:31 AM +0200
+# Last Change: Sun Oct 18, 2026 at 04:58 PM -0400
 
 __name__ = 'pyTuplingUtils'
 __version__ = '0.0.1'
 
-import pyTuplingUtils.boolean
-import pyTuplingUtils.io
-import pyTuplingUtils.argparse
-import pyTuplingUtils.plot
-import pyTuplingUtils.utils
-import pyTuplingUtils.cutflow
+from importlib import import_module
+
+# Submodules are imported on first access (PEP 562), so that e.g. scripts
+# only using 'io' don't pay for importing matplotlib or building the parser.
+SUBMODULES = ('boolean', 'io', 'argparse', 'plot', 'utils', 'cutflow')
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(SUBMODULES))
@@ -2,7 +2,19 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Thu Apr 30, 2020 at 10:53 PM +0800
+# Last Change: Sun Oct 18, 2026 at 04:58 PM -0400
 
-import pyTuplingUtils.boolean.syntax
-import pyTuplingUtils.boolean.eval
+from importlib import import_module
+
+# Submodules are imported on first access (PEP 562)
+SUBMODULES = ('syntax', 'const', 'optimize', 'eval')
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(SUBMODULES))
@@ -2,7 +2,7 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Fri Mar 03, 2023 at 06:31 PM -0500
+# Last Change: Sun Oct 18, 2026 at 01:17 PM -0400
 
 import numpy as np
 
@@ -35,3 +35,18 @@ KNOWN_FUNC = {
     'GT': lambda x, y: x > y,
     'LT': lambda x, y: x < y,
 }
+
+# Kernel-safe equivalents of 'KNOWN_FUNC' for the numexpr backend, as
+# (template, whether the result is boolean)
+NUMEXPR_FUNC = {
+    'abs': ('abs({0})', False),
+    'log': ('log({0})', False),
+    'sin': ('sin({0})', False),
+    'sqrt': ('sqrt({0})', False),
+    'ONE': ('1', False),
+    'LOG10pp': ('log10(1-({0}*{3} + {1}*{4} + {2}*{5})/sqrt({0}*{0}+{1}*{1}+{2}*{2})/sqrt({3}*{3}+{4}*{4}+{5}*{5}))', False),
+    'ETA': ('log(({0}+{1})/({0}-{1}))/2.', False),
+    'NORM2': ('sqrt({0}*{0} + {1}*{1})', False),
+    'GT': ('({0} > {1})', True),
+    'LT': ('({0} < {1})', True),
+}
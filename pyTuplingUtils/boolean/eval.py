@@ -2,15 +2,85 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Tue Jun 21, 2022 at 02:01 PM -0400
+# Last Change: Sun Oct 18, 2026 at 10:55 PM -0400
 
+import numpy as np
+
+from collections import OrderedDict, ChainMap
+from functools import lru_cache
 from lark import Transformer, v_args
 
 from numpy import logical_and as AND, logical_or as OR, logical_not as NOT
-from pyTuplingUtils.io import read_branches_dict
+from pyTuplingUtils.io import read_branches_dict, iter_branches, STEP_SIZE
+from pyTuplingUtils.io import LazyBranches
 from pyTuplingUtils.boolean.syntax import boolean_parser
-from pyTuplingUtils.boolean.const import KNOWN_SYMB, KNOWN_FUNC
+from pyTuplingUtils.boolean.const import KNOWN_SYMB, KNOWN_FUNC, NUMEXPR_FUNC
+from pyTuplingUtils.boolean.optimize import parse_num, canonicalize
+from pyTuplingUtils.boolean.optimize import ChainEvaluator, is_chain
+from pyTuplingUtils.boolean.optimize import simplify, find_common
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+###############
+# Memoization #
+###############
+
+MEMO_SIZE = 64 * 1024**2  # in bytes
+MEMO_SKIP = ('num', 'bool', 'var', 'arglist')
+# The value of the left operand that decides the result on its own
+SHORT_CIRCUIT_OPS = {'andop': False, 'orop': True}
+
+
+# A LRU cache of evaluated arrays, capped by their total size in bytes.
+class MemoCache(object):
+    def __init__(self, max_size=MEMO_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.data = OrderedDict()
+
+    def __getitem__(self, key):
+        try:
+            val = self.data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+
+        self.hits += 1
+        self.data.move_to_end(key)
+        return val
+
+    # NOTE: Stored arrays are made read-only, as they're handed out again
+    def __setitem__(self, key, val):
+        if val.nbytes > self.max_size:
+            return
+        if key in self.data:
+            self.size -= self.data.pop(key).nbytes
+
+        val.flags.writeable = False
+        self.data[key] = val
+        self.size += val.nbytes
+
+        while self.size > self.max_size:
+            _, evicted = self.data.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+        self.size = 0
+
 
+####################
+# Tree transformer #
+####################
 
 class TransForTupling(Transformer):
     def __init__(self, known_symb=KNOWN_SYMB, known_func=KNOWN_FUNC):
@@ -18,6 +88,52 @@ class TransForTupling(Transformer):
         self.cache.update(known_symb)
         self.known_symb = known_symb
         self.known_func = known_func
+        self.memo = None
+        self.common = set()
+        self.common_results = {}
+
+    # Reuse the results of identical subtrees, if a memo cache is attached.
+    # Subtrees in 'common' are also reused within a single transformation.
+    def _transform_tree(self, tree):
+        if tree.data in MEMO_SKIP or (self.memo is None and not self.common):
+            return self.short_circuit(tree)
+
+        key = canonicalize(tree)
+        if key in self.common_results:
+            return self.common_results[key]
+
+        if self.memo is not None:
+            try:
+                return self.memo[key]
+            except KeyError:
+                pass
+
+        result = self.short_circuit(tree)
+        if key in self.common:
+            self.common_results[key] = result
+        if self.memo is not None and isinstance(result, np.ndarray):
+            self.memo[key] = result
+        return result
+
+    # Skip the right operand of '&' ('|') if the left one is all False (True),
+    # so that branches only needed by the right operand are never read.
+    def short_circuit(self, tree):
+        if tree.data not in SHORT_CIRCUIT_OPS:
+            return super()._transform_tree(tree)
+
+        lhs, rhs = tree.children
+        lhs = next(self._transform_children([lhs]))
+
+        # NOTE: A scalar can't decide the shape of the result
+        if isinstance(lhs, np.ndarray) and lhs.size:
+            decided = lhs.all() if SHORT_CIRCUIT_OPS[tree.data] \
+                else not lhs.any()
+            # NOTE: Never hand out 'lhs' itself, which may be a cached branch
+            if decided:
+                return np.full(lhs.shape, SHORT_CIRCUIT_OPS[tree.data])
+
+        rhs = next(self._transform_children([rhs]))
+        return self._call_userfunc(tree, [lhs, rhs])
 
     ########
     # atom #
@@ -25,10 +141,7 @@ class TransForTupling(Transformer):
 
     @v_args(inline=True)
     def num(self, val):
-        try:
-            return int(val)
-        except ValueError:
-            return float(val)
+        return parse_num(val)
 
     @v_args(inline=True)
     def bool(self, val):
@@ -126,24 +239,500 @@ class TransForTupling(Transformer):
             return self.known_func[str(func_name)]()
 
 
+########################
+# Compiled expressions #
+########################
+
+def gen_binary_op(op):
+    return v_args(inline=True)(
+        lambda self, arg1, arg2: f'({arg1} {op} {arg2})')
+
+
+# Lower the syntax tree into a Python source string of NumPy operations.
+# Branches are looked up in '_b', known symbols in '_s' and known functions in
+# '_f', so branch names never clash with the names used in the namespace.
+class TransForPython(Transformer):
+    def __init__(self, known_symb=KNOWN_SYMB, known_func=KNOWN_FUNC):
+        self.known_symb = known_symb
+        self.known_func = known_func
+
+    @v_args(inline=True)
+    def num(self, val):
+        return repr(parse_num(val))
+
+    @v_args(inline=True)
+    def bool(self, val):
+        return 'True' if val.lower() == 'true' else 'False'
+
+    @v_args(inline=True)
+    def var(self, val):
+        if val.value in self.known_symb:
+            return f'_s[{val.value!r}]'
+        return f'_b[{val.value!r}]'
+
+    @v_args(inline=True)
+    def neg(self, val):
+        return f'(-{val})'
+
+    mul = gen_binary_op('*')
+    div = gen_binary_op('/')
+    add = gen_binary_op('+')
+    sub = gen_binary_op('-')
+    eq = gen_binary_op('==')
+    neq = gen_binary_op('!=')
+    gt = gen_binary_op('>')
+    gte = gen_binary_op('>=')
+    lt = gen_binary_op('<')
+    lte = gen_binary_op('<=')
+
+    @v_args(inline=True)
+    def comp(self, cond):
+        return f'NOT({cond})'
+
+    @v_args(inline=True)
+    def andop(self, cond1, cond2):
+        return f'AND({cond1}, {cond2})'
+
+    @v_args(inline=True)
+    def orop(self, cond1, cond2):
+        return f'OR({cond1}, {cond2})'
+
+    @v_args(inline=True)
+    def func_call(self, func_name, arglist=None):
+        args = ', '.join(arglist.children) if arglist is not None else ''
+        return f'_f[{str(func_name)!r}]({args})'
+
+
+class CompiledExpr(object):
+    def __init__(self, expr, known_symb=KNOWN_SYMB, known_func=KNOWN_FUNC):
+        known_symb = KNOWN_SYMB if known_symb is None else known_symb
+        known_func = KNOWN_FUNC if known_func is None else known_func
+
+        self.expr = expr
+        self.known_symb = known_symb
+        self.known_func = known_func
+
+        tree = parse_expr(expr)
+        self.vars = find_vars(tree, known_symb)
+        self.src = 'lambda _b: ' + TransForPython(
+            known_symb, known_func).transform(tree)
+
+        namespace = {'AND': AND, 'OR': OR, 'NOT': NOT,
+                     '_s': known_symb, '_f': known_func}
+        self.func = eval(compile(self.src, f'<{expr}>', 'eval'), namespace)
+
+    def __call__(self, branches):
+        return self.func(branches)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.expr!r})'
+
+    def __reduce__(self):
+        # NOTE: The default function table contains lambdas, which can't be
+        #       pickled. Refer to the default tables implicitly.
+        if self.known_symb is KNOWN_SYMB and self.known_func is KNOWN_FUNC:
+            return compile_expr, (self.expr,)
+        return self.__class__, (
+            self.expr,
+            None if self.known_symb is KNOWN_SYMB else self.known_symb,
+            None if self.known_func is KNOWN_FUNC else self.known_func)
+
+
+###################
+# Numexpr backend #
+###################
+
+# NOTE: numexpr treats literals as double and upcasts narrow integers, while
+#       NumPy keeps e.g. float32 for 'x > 0.1', so only dtypes for which both
+#       agree are lowered. Unsigned integers are not supported at all.
+NUMEXPR_DTYPES = tuple(np.dtype(t) for t in (bool, np.int32, np.int64,
+                                             np.float64))
+
+
+class NotLowerable(Exception):
+    pass
+
+
+def gen_numexpr_arith_op(op):
+    @v_args(inline=True)
+    def lower(self, arg1, arg2):
+        self.ensure(arg1[1] != 'b' and arg2[1] != 'b')
+        kind = 'f' if op == '/' or 'f' in (arg1[1], arg2[1]) else 'i'
+        return f'({arg1[0]} {op} {arg2[0]})', kind
+    return lower
+
+
+def gen_numexpr_cmp_op(op):
+    @v_args(inline=True)
+    def lower(self, lhs, rhs):
+        is_bool = lhs[1] == 'b'
+        self.ensure(is_bool == (rhs[1] == 'b') and
+                    (not is_bool or op in ('==', '!=')))
+        return f'({lhs[0]} {op} {rhs[0]})', 'b'
+    return lower
+
+
+def gen_numexpr_bool_op(op):
+    @v_args(inline=True)
+    def lower(self, cond1, cond2):
+        self.ensure(cond1[1] == 'b' and cond2[1] == 'b')
+        return f'({cond1[0]} {op} {cond2[0]})', 'b'
+    return lower
+
+
+# Lower the syntax tree into a single numexpr kernel, so that no full-size
+# temporary array is allocated per node. Each node becomes a (source, dtype
+# kind) pair, with kind being one of 'b', 'i' and 'f'; 'NotLowerable' is
+# raised for anything whose numexpr semantics would differ from NumPy's, e.g.
+# '&' on integers.
+class TransForNumexpr(Transformer):
+    def __init__(self, branches, known_symb=KNOWN_SYMB, known_func=KNOWN_FUNC):
+        self.branches = branches
+        self.known_symb = known_symb
+        self.known_func = known_func
+        self.local_dict = {}
+
+    @staticmethod
+    def ensure(cond):
+        if not cond:
+            raise NotLowerable
+
+    @v_args(inline=True)
+    def num(self, val):
+        val = parse_num(val)
+        return repr(val), 'i' if isinstance(val, int) else 'f'
+
+    @v_args(inline=True)
+    def bool(self, val):
+        return ('True', 'b') if val.lower() == 'true' else ('False', 'b')
+
+    @v_args(inline=True)
+    def var(self, val):
+        if val.value in self.known_symb:
+            return repr(float(self.known_symb[val.value])), 'f'
+
+        arr = self.branches[val.value]
+        self.ensure(arr.dtype in NUMEXPR_DTYPES)
+
+        # NOTE: Rename branches so that they never clash with numexpr functions
+        name = f'v{len(self.local_dict)}'
+        self.local_dict[name] = arr
+        return name, arr.dtype.kind
+
+    @v_args(inline=True)
+    def neg(self, val):
+        self.ensure(val[1] != 'b')
+        return f'(-{val[0]})', val[1]
+
+    mul = gen_numexpr_arith_op('*')
+    div = gen_numexpr_arith_op('/')
+    add = gen_numexpr_arith_op('+')
+    sub = gen_numexpr_arith_op('-')
+
+    eq = gen_numexpr_cmp_op('==')
+    neq = gen_numexpr_cmp_op('!=')
+    gt = gen_numexpr_cmp_op('>')
+    gte = gen_numexpr_cmp_op('>=')
+    lt = gen_numexpr_cmp_op('<')
+    lte = gen_numexpr_cmp_op('<=')
+
+    @v_args(inline=True)
+    def comp(self, cond):
+        self.ensure(cond[1] == 'b')
+        return f'(~{cond[0]})', 'b'
+
+    andop = gen_numexpr_bool_op('&')
+    orop = gen_numexpr_bool_op('|')
+
+    @v_args(inline=True)
+    def func_call(self, func_name, arglist=None):
+        name = str(func_name)
+        # Only functions that are not overridden by the user are known
+        self.ensure(name in NUMEXPR_FUNC and
+                    self.known_func.get(name) is KNOWN_FUNC[name])
+
+        args = arglist.children if arglist is not None else []
+        kinds = [k for _, k in args]
+        self.ensure('b' not in kinds)
+        # NOTE: NumPy keeps integers for 'abs', but numexpr returns double
+        if name == 'abs':
+            self.ensure(kinds == ['f'])
+
+        template, is_bool = NUMEXPR_FUNC[name]
+        kind = 'b' if is_bool else 'i' if name == 'ONE' else 'f'
+        return template.format(*[f'({a})' for a, _ in args]), kind
+
+
+def eval_numexpr(tree, transformer):
+    lowered = TransForNumexpr(
+        transformer.cache, transformer.known_symb, transformer.known_func)
+    src, _ = lowered.transform(tree)
+
+    # Pure scalar expressions are cheaper in Python
+    if not lowered.local_dict:
+        raise NotLowerable
+
+    return numexpr.evaluate(src, local_dict=lowered.local_dict)
+
+
+COMPILE_CACHE_SIZE = 256
+PARSE_CACHE_SIZE = 1024
+
+
+def normalize_expr(expr):
+    return ' '.join(expr.split())
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_normalized_expr(expr):
+    return boolean_parser.parse(expr)
+
+
+# Parse an expression, reusing the tree of any expression that only differs in
+# whitespace.
+# NOTE: Trees are shared, so they must never be modified in place
+def parse_expr(expr):
+    return parse_normalized_expr(normalize_expr(expr))
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_normalized_expr(expr):
+    return CompiledExpr(expr)
+
+
+# Compile an expression with the default symbols and functions into a callable
+# that takes a dict of branches.
+def compile_expr(expr):
+    return compile_normalized_expr(normalize_expr(expr))
+
+
+def find_vars(tree, known_symb=KNOWN_SYMB):
+    result = []
+    for n in tree.find_data('var'):
+        name = str(n.children[0])
+        if name not in known_symb and name not in result:
+            result.append(name)
+    return result
+
+
+BACKENDS = ('numpy', 'numexpr')
+
+
 class BooleanEvaluator(object):
-    def __init__(self, ntp, tree, transformer=TransForTupling, **kwargs):
-        self.parser = boolean_parser.parse
+    def __init__(self, ntp, tree, transformer=TransForTupling,
+                 memo_size=0, backend='numpy', workers=None,
+                 pool='thread', branches=None, optimize=False,
+                 entry_start=None, entry_stop=None, **kwargs):
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend: {backend}')
+        if backend == 'numexpr' and numexpr is None:
+            raise ImportError('The numexpr backend requires numexpr.')
+
+        self.parser = parse_expr
         self.ntp = ntp
         self.tree = tree
+        self.backend = backend
+        self.workers = workers
+        self.pool = pool
+        self.entry_start = entry_start
+        self.entry_stop = entry_stop
+        self.optimize = optimize
         self.transformer = transformer(**kwargs)
 
+        # Use preloaded branches, or a 'LazyBranches' to read them on demand.
+        # Symbols and branches loaded later never go into the caller's mapping
+        self.branches = branches
+        if branches is not None:
+            self.transformer.cache = ChainMap(self.transformer.cache, branches)
+
+        # Results are memoized per ntuple/tree if 'memo_size' is set, e.g. to
+        # 'MEMO_SIZE'. Memoized results are read-only, so copy them before
+        # modifying
+        self.memo = MemoCache(memo_size) if memo_size else None
+        self.transformer.memo = self.memo
+        # A separate transformer for in-memory chunks, so that chunks never
+        # mix with the branches cached for the full dataset
+        self.chunk_transformer = transformer(**kwargs)
+        # Terms of AND/OR chains are evaluated on subsets of the candidates,
+        # so they must not share the memo
+        self.subset_transformer = transformer(**kwargs)
+        self.chains = ChainEvaluator(self.eval_term, self.find_vars)
+
+        known_symb = self.transformer.known_symb
+        known_func = self.transformer.known_func
+        if known_symb is KNOWN_SYMB and known_func is KNOWN_FUNC:
+            self.compiler = compile_normalized_expr
+        else:
+            self.compiler = lru_cache(maxsize=COMPILE_CACHE_SIZE)(
+                lambda expr: CompiledExpr(expr, known_symb, known_func))
+        # Simplified trees depend on the symbols and functions, so they're
+        # cached per evaluator
+        self.simplified = lru_cache(maxsize=PARSE_CACHE_SIZE)(
+            lambda expr: self.simplify(parse_normalized_expr(expr)))
+
     def parse(self, s):
-        return self.parser(s)
+        return self.optimized(s) if self.optimize else self.parser(s)
+
+    def simplify(self, tree):
+        return simplify(tree, self.transformer.known_symb,
+                        self.transformer.known_func)
+
+    # The tree that is actually evaluated when 'optimize' is on
+    def optimized(self, s):
+        return self.simplified(normalize_expr(s))
+
+    def find_vars(self, tree):
+        return find_vars(tree, self.transformer.known_symb)
+
+    def collect_vars(self, trees):
+        result = []
+        for t in trees:
+            result += [v for v in self.find_vars(t) if v not in result]
+        return result
+
+    def compile(self, expr):
+        return self.compiler(normalize_expr(expr))
+
+    # Read the branches that are not cached yet, in a single pass
+    def load(self, branches):
+        # NOTE: Lazy branches are read only when they're actually needed
+        if isinstance(self.branches, LazyBranches):
+            return
+
+        vars_to_load = [b for b in branches
+                        if b not in self.transformer.cache]
+        if vars_to_load:
+            self.transformer.cache.update(read_branches_dict(
+                self.ntp, self.tree, vars_to_load, workers=self.workers,
+                pool=self.pool, entry_start=self.entry_start,
+                entry_stop=self.entry_stop))
+
+    # Load all variables needed by a batch of expressions
+    def preload(self, exprs):
+        self.load(self.collect_vars([self.parse(e) for e in exprs]))
+
+    def transform(self, tree, transformer):
+        if self.optimize and is_chain(tree):
+            return self.transform_chain(tree, transformer)
+        return self.transform_tree(tree, transformer)
+
+    def transform_chain(self, tree, transformer):
+        memo = getattr(transformer, 'memo', None)
+        key = canonicalize(tree)
+
+        if memo is not None:
+            try:
+                return memo[key]
+            except KeyError:
+                pass
+
+        result = self.chains.eval(tree, transformer.cache)
+
+        if memo is not None:
+            memo[key] = result
+        return result
+
+    def eval_term(self, tree, branches):
+        self.subset_transformer.cache = dict(
+            self.subset_transformer.known_symb)
+        self.subset_transformer.cache.update(branches)
+        return self.transform_tree(tree, self.subset_transformer)
+
+    def transform_tree(self, tree, transformer):
+        if not self.optimize or not hasattr(transformer, 'common'):
+            return self.transform_backend(tree, transformer)
+
+        # Evaluate common subexpressions only once
+        transformer.common = find_common(tree)
+        try:
+            return self.transform_backend(tree, transformer)
+        finally:
+            transformer.common = set()
+            transformer.common_results = {}
+
+    def transform_backend(self, tree, transformer):
+        if self.backend == 'numexpr':
+            memo = getattr(transformer, 'memo', None)
+            key = canonicalize(tree)
+
+            if memo is not None:
+                try:
+                    return memo[key]
+                except KeyError:
+                    pass
+
+            # Fall back to the NumPy transformer if numexpr can't handle it
+            try:
+                result = eval_numexpr(tree, transformer)
+            except Exception:
+                return transformer.transform(tree)
+
+            if memo is not None:
+                memo[key] = result
+            return result
+
+        return transformer.transform(tree)
 
     def eval(self, s):
         tree = self.parse(s)
 
         # Load all variables in the expression in batch
-        vars_to_load = [str(n.children[0]) for n in tree.find_data('var')
-                        if str(n.children[0]) not in
-                        self.transformer.known_symb.keys()]
-        self.transformer.cache.update(read_branches_dict(
-            self.ntp, self.tree, vars_to_load))
-
-        return self.transformer.transform(tree)
+        self.load(self.find_vars(tree))
+
+        return self.transform(tree, self.transformer)
+
+    def eval_chunk(self, s, chunk):
+        tree = self.parse(s) if isinstance(s, str) else s
+
+        self.chunk_transformer.cache = dict(self.chunk_transformer.known_symb)
+        self.chunk_transformer.cache.update(chunk)
+
+        return self.transform(tree, self.chunk_transformer)
+
+    # Evaluate one or more expressions chunk by chunk. All branches needed by
+    # the expressions are read in a single pass.
+    # NOTE: Chunks are defined by the branches that are read, so at least one
+    #       expression must depend on a branch
+    def iter_eval(self, exprs, step_size=STEP_SIZE):
+        single = isinstance(exprs, str)
+        trees = [self.parse(e) for e in ([exprs] if single else exprs)]
+        branches = self.collect_vars(trees)
+        if not branches:
+            raise ValueError(
+                f'Can\'t evaluate in chunks without any branch: {exprs}')
+
+        for chunk in iter_branches(
+                self.ntp, self.tree, branches, step_size,
+                self.entry_start, self.entry_stop):
+            result = [self.eval_chunk(t, chunk) for t in trees]
+            yield result[0] if single else result
+
+
+################
+# Job planning #
+################
+# Evaluate all expressions of a job on the same ntuple/tree, e.g. the
+# branches, weights and cuts of a plot. The branches needed by any of them
+# are read in a single pass, then everything is evaluated from memory.
+
+class JobPlanner(object):
+    def __init__(self, ntp, tree, exprs=(), **kwargs):
+        self.evaluator = BooleanEvaluator(ntp, tree, **kwargs)
+        self.exprs = []
+        self.add(*exprs)
+
+    # Empty expressions and 'None' (from the command line) are skipped
+    def add(self, *exprs):
+        for e in exprs:
+            if e and e != 'None' and e not in self.exprs:
+                self.exprs.append(e)
+        return self
+
+    @property
+    def branches(self):
+        return self.evaluator.collect_vars(
+            [self.evaluator.parse(e) for e in self.exprs])
+
+    def run(self):
+        self.evaluator.load(self.branches)
+        return {e: self.evaluator.eval(e) for e in self.exprs}
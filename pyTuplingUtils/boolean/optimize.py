@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+#
+# Author: Yipeng Sun
+# License: BSD 2-clause
+# Last Change: Sun Oct 18, 2026 at 11:45 PM -0400
+
+import numpy as np
+
+from collections import Counter
+from lark import Transformer, Tree, Token, v_args
+from time import perf_counter
+from numpy import logical_and as AND, logical_or as OR, logical_not as NOT
+
+from pyTuplingUtils.boolean.const import KNOWN_SYMB, KNOWN_FUNC, NUMEXPR_FUNC
+
+
+################
+# Tree helpers #
+################
+
+COMMUTATIVE_OPS = ('add', 'mul', 'eq', 'neq', 'andop', 'orop')
+ATOMS = ('num', 'bool', 'var', 'arglist')
+
+
+def parse_num(val):
+    try:
+        return int(val)
+    except ValueError:
+        return float(val)
+
+
+# Canonical form of a (sub)tree, so that e.g. 'a & b' and 'b & a' share the
+# same key.
+def canonicalize(tree):
+    if not isinstance(tree, Tree):
+        return str(tree)
+
+    if tree.data == 'num':
+        return repr(parse_num(tree.children[0]))
+    if tree.data in ('bool', 'var'):
+        return f'{tree.data}:{tree.children[0]}'
+
+    args = [canonicalize(c) for c in tree.children]
+    if tree.data in COMMUTATIVE_OPS:
+        args.sort()
+    return f'{tree.data}({",".join(args)})'
+
+
+# Convert a tree back to an expression, e.g. to show the optimized tree.
+class TransForExpr(Transformer):
+    @v_args(inline=True)
+    def num(self, val):
+        return str(val)
+
+    @v_args(inline=True)
+    def bool(self, val):
+        return str(val)
+
+    @v_args(inline=True)
+    def var(self, val):
+        return str(val)
+
+    @v_args(inline=True)
+    def neg(self, val):
+        return f'-{val}'
+
+    @v_args(inline=True)
+    def comp(self, val):
+        return f'!{val}'
+
+    @v_args(inline=True)
+    def func_call(self, func_name, arglist=None):
+        return f'{func_name}({arglist or ""})'
+
+    def arglist(self, args):
+        return ', '.join(args)
+
+
+def gen_expr_op(op):
+    return v_args(inline=True)(
+        lambda self, arg1, arg2: f'({arg1} {op} {arg2})')
+
+
+for name, op in [('add', '+'), ('sub', '-'), ('mul', '*'), ('div', '/'),
+                 ('eq', '=='), ('neq', '!='), ('gt', '>'), ('gte', '>='),
+                 ('lt', '<'), ('lte', '<='), ('andop', '&'), ('orop', '|')]:
+    setattr(TransForExpr, name, gen_expr_op(op))
+
+
+def to_expr(tree):
+    return TransForExpr().transform(tree)
+
+
+##################
+# Simplification #
+##################
+# Fold known symbols and constant subexpressions into literals, and drop
+# 'true'/'false' operands that don't change the result of '&'/'|'.
+# NOTE: 'true & x' is only reduced to 'x' if 'x' is boolean, otherwise the
+#       result type would change
+
+FOLD_OPS = {
+    'add': lambda x, y: x + y,
+    'sub': lambda x, y: x - y,
+    'mul': lambda x, y: x * y,
+    'div': lambda x, y: x / y,
+    'eq': lambda x, y: x == y,
+    'neq': lambda x, y: x != y,
+    'gt': lambda x, y: x > y,
+    'gte': lambda x, y: x >= y,
+    'lt': lambda x, y: x < y,
+    'lte': lambda x, y: x <= y,
+    'andop': AND,
+    'orop': OR,
+    'neg': lambda x: -x,
+    'comp': NOT,
+}
+BOOL_OPS = ('eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'andop', 'orop', 'comp',
+            'bool')
+# The operand value that leaves the other operand unchanged
+IDENTITY_OPERANDS = {'andop': True, 'orop': False}
+
+
+# NOTE: Functions are only known to be boolean if they're the built-in ones
+def is_bool(tree, known_func=KNOWN_FUNC):
+    if tree.data == 'func_call':
+        name = str(tree.children[0])
+        if known_func.get(name) is not KNOWN_FUNC.get(name):
+            return False
+        return NUMEXPR_FUNC.get(name, (None, False))[1]
+    return tree.data in BOOL_OPS
+
+
+def is_const(tree):
+    return isinstance(tree, Tree) and tree.data in ('num', 'bool')
+
+
+def const_value(tree):
+    if tree.data == 'bool':
+        return tree.children[0].lower() == 'true'
+    return parse_num(tree.children[0])
+
+
+def const_tree(val):
+    if isinstance(val, np.generic):
+        val = val.item()
+
+    if isinstance(val, bool):
+        return Tree('bool', [Token('BOOL', str(val))])
+    if isinstance(val, (int, float)) and np.isfinite(val):
+        return Tree('num', [Token('NUMBER', repr(val))])
+    return None
+
+
+class Simplifier(Transformer):
+    def __init__(self, known_symb=KNOWN_SYMB, known_func=KNOWN_FUNC):
+        self.known_symb = known_symb
+        self.known_func = known_func
+
+    def __default__(self, data, children, meta):
+        tree = Tree(data, children, meta)
+        if data in FOLD_OPS and all(is_const(c) for c in children):
+            return self.fold(tree, FOLD_OPS[data],
+                             [const_value(c) for c in children])
+        if data in IDENTITY_OPERANDS:
+            return self.drop_identity(tree)
+        return tree
+
+    def var(self, children):
+        name = str(children[0])
+        if name in self.known_symb:
+            return const_tree(self.known_symb[name]) or Tree('var', children)
+        return Tree('var', children)
+
+    def func_call(self, children):
+        tree = Tree('func_call', children)
+        args = children[1].children if len(children) > 1 and children[1] \
+            else []
+        func = self.known_func.get(str(children[0]))
+
+        if func is None or not all(is_const(a) for a in args):
+            return tree
+        return self.fold(tree, func, [const_value(a) for a in args])
+
+    @staticmethod
+    def fold(tree, func, args):
+        try:
+            with np.errstate(all='raise'):
+                folded = const_tree(func(*args))
+        except (ArithmeticError, FloatingPointError, ValueError):
+            folded = None
+        return tree if folded is None else folded
+
+    def drop_identity(self, tree):
+        identity = IDENTITY_OPERANDS[tree.data]
+        lhs, rhs = tree.children
+
+        for const, other in [(lhs, rhs), (rhs, lhs)]:
+            if is_const(const) and const.data == 'bool' and \
+                    const_value(const) == identity and \
+                    isinstance(other, Tree) and is_bool(other, self.known_func):
+                return other
+        return tree
+
+
+def simplify(tree, known_symb=KNOWN_SYMB, known_func=KNOWN_FUNC):
+    return Simplifier(known_symb, known_func).transform(tree)
+
+
+# Canonical forms of the non-trivial subtrees that appear more than once.
+def find_common(tree):
+    counts = Counter(canonicalize(t) for t in tree.iter_subtrees()
+                     if t.data not in ATOMS)
+    return {k for k, n in counts.items() if n > 1}
+
+
+#################
+# AND/OR chains #
+#################
+# A chain like 'a & b & c' is evaluated term by term. Each term is only
+# evaluated on the candidates that are still undecided, i.e. that passed all
+# previous terms of an AND chain (failed, for an OR chain). The terms are
+# ordered so that cheap and decisive terms go first, based on their cost and
+# pass rate measured on a sample of the candidates.
+
+SAMPLE_SIZE = 1024
+CHAIN_OPS = ('andop', 'orop')
+
+
+def is_chain(tree):
+    return isinstance(tree, Tree) and tree.data in CHAIN_OPS
+
+
+# Collect the terms of a chain, i.e. 'a & (b & c)' -> [a, b, c].
+# NOTE: Terms of a different chain type are kept as they are
+def flatten_chain(tree):
+    terms = []
+    for c in tree.children:
+        if isinstance(c, Tree) and c.data == tree.data:
+            terms += flatten_chain(c)
+        else:
+            terms.append(c)
+    return terms
+
+
+class ChainEvaluator(object):
+    # 'eval_term' evaluates a tree with a dict of branches, and 'find_vars'
+    # lists the branches needed by a tree.
+    def __init__(self, eval_term, find_vars, sample_size=SAMPLE_SIZE):
+        self.eval_term = eval_term
+        self.find_vars = find_vars
+        self.sample_size = sample_size
+
+    def eval(self, tree, branches):
+        if not is_chain(tree):
+            return self.eval_term(
+                tree, {v: branches[v] for v in self.find_vars(tree)})
+
+        terms = [(t, self.find_vars(t)) for t in flatten_chain(tree)]
+        first_var = next((v[0] for _, v in terms if v), None)
+        # Pure scalar chains have nothing to compact
+        if first_var is None:
+            return self.eval_term(tree, {})
+
+        # Candidates are compacted along a single axis, so multi-dimensional
+        # branches are evaluated as a whole
+        all_vars = {v for _, term_vars in terms for v in term_vars}
+        if any(np.ndim(branches[v]) != 1 for v in all_vars):
+            return self.eval_term(tree, {v: branches[v] for v in all_vars})
+
+        size = len(branches[first_var])
+        terms = self.order(tree.data, terms, branches, size)
+
+        # Indices of undecided candidates
+        idx = None
+        for term, term_vars in terms:
+            if idx is None:
+                sub = {v: branches[v] for v in term_vars}
+            else:
+                sub = {v: branches[v][idx] for v in term_vars}
+
+            mask = self.eval_mask(term, sub, size if idx is None else idx.size)
+            if tree.data == 'orop':
+                mask = ~mask
+            idx = np.flatnonzero(mask) if idx is None else idx[mask]
+
+            if not idx.size:
+                break
+
+        if tree.data == 'andop':
+            result = np.zeros(size, dtype=bool)
+            result[idx] = True
+        else:
+            result = np.ones(size, dtype=bool)
+            result[idx] = False
+        return result
+
+    def eval_mask(self, tree, branches, size):
+        mask = np.asarray(self.eval(tree, branches), dtype=bool)
+        return np.broadcast_to(mask, (size,))
+
+    # Order terms by cost per decided candidate, estimated on a sample.
+    def order(self, op, terms, branches, size):
+        if len(terms) < 2:
+            return terms
+
+        sample = np.unique(np.linspace(
+            0, size-1, min(self.sample_size, size)).astype(int))
+
+        ranks = []
+        for term, term_vars in terms:
+            sub = {v: branches[v][sample] for v in term_vars}
+
+            start = perf_counter()
+            pass_rate = self.eval_mask(term, sub, sample.size).mean()
+            cost = perf_counter() - start
+
+            decided = 1 - pass_rate if op == 'andop' else pass_rate
+            ranks.append(cost / max(decided, 1 / sample.size))
+
+        order = np.argsort(ranks, kind='stable')
+        return [terms[i] for i in order]
@@ -2,9 +2,14 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Wed Jun 17, 2020 at 03:16 AM +0800
+# Last Change: Sun Oct 18, 2026 at 10:45 PM -0400
 
-from lark import Lark
+import os
+import os.path as osp
+import sys
+
+from hashlib import md5
+from lark import Lark, __version__ as lark_version
 
 
 boolean_grammar = '''
@@ -55,4 +60,37 @@ boolean_grammar = '''
     BOOL.2: "True" | "False" | "true" | "false"  // These keywords have higher priority
 '''
 
-boolean_parser = Lark(boolean_grammar, parser='lalr')
+CACHE_DIR = osp.join(
+    os.environ.get('XDG_CACHE_HOME') or osp.expanduser('~/.cache'),
+    'pyTuplingUtils')
+
+
+# Path of the cached LALR table, or None if there's no private cache directory.
+# NOTE: Lark unpickles the cache, so it must only live in a directory that is
+#       owned by, and only writable by, the current user
+def parser_cache_path(cache_dir=CACHE_DIR):
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        st = os.stat(cache_dir)
+    except OSError:
+        return None
+
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return None
+    if st.st_mode & 0o077:
+        return None
+
+    key = md5(boolean_grammar.encode('utf8')).hexdigest()
+    return osp.join(cache_dir, 'lark_{}_{}_{}_{}.cache'.format(
+        key, lark_version, *sys.version_info[:2]))
+
+
+# The LALR table is cached in a per-user directory, so it's only built once
+# for each grammar/Lark/Python version
+CACHE_PATH = parser_cache_path()
+
+try:
+    boolean_parser = Lark(boolean_grammar, parser='lalr',
+                          cache=CACHE_PATH or False)
+except OSError:
+    boolean_parser = Lark(boolean_grammar, parser='lalr')
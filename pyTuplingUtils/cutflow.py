@@ -2,17 +2,23 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Wed Feb 16, 2022 at 04:15 PM -0500
+# Last Change: Sun Oct 18, 2026 at 10:05 PM -0400
 
 from dataclasses import dataclass
 from typing import Union, Optional
-from numpy import sum
+from itertools import repeat
+from numpy import sum, ndarray, packbits, unpackbits, union1d
+from numpy import zeros, array, broadcast_to, sqrt, nan
 from numpy import logical_and as AND
-from copy import deepcopy
+
+try:
+    from scipy.stats import beta
+except ImportError:
+    beta = None
 
 from pyTuplingUtils.boolean.eval import BooleanEvaluator
-from pyTuplingUtils.utils import extract_uid
-from pyTuplingUtils.io import read_branches
+from pyTuplingUtils.utils import extract_uid, pack_uid, unique_uid, promote_uid
+from pyTuplingUtils.io import read_branches, regulate_input, STEP_SIZE, POOLS
 
 
 def cutflow_uniq_events_outer(
@@ -26,6 +32,134 @@ def cutflow_uniq_events_outer(
     return inner
 
 
+#############################
+# Mergeable output counters #
+#############################
+# For streaming, the output of each rule is computed per chunk ('chunk'), and
+# the per-chunk states are then merged ('merge') across chunks and files
+# before the final number is computed ('result'). Extra branches (or
+# expressions) needed by a counter are listed in 'branches' and passed to
+# 'chunk' after the mask. 'columns' adds extra entries to the cutflow result.
+
+class CutflowCounter(object):
+    branches = []
+
+    def empty(self):
+        return 0
+
+    def chunk(self, mask):
+        return sum(mask)
+
+    def merge(self, state1, state2):
+        return state1 + state2
+
+    def result(self, state):
+        return state
+
+    def columns(self, state):
+        return {}
+
+
+# Wraps a regular, additive 'output_regulator'
+class CutflowFuncCounter(CutflowCounter):
+    def __init__(self, func, ntp, tree):
+        self.func = func
+        self.ntp = ntp
+        self.tree = tree
+
+    def chunk(self, mask):
+        return self.func(self.ntp, self.tree, mask)
+
+
+# Streaming version of 'cutflow_uniq_events_outer': the unique IDs of the
+# selected events are kept, so that they can be merged across chunks.
+class CutflowUniqEventsCounter(CutflowCounter):
+    def __init__(self, run_branch='runNumber', event_branch='eventNumber'):
+        self.branches = [run_branch, event_branch]
+
+    def empty(self):
+        return pack_uid([], [])
+
+    def chunk(self, mask, run, event):
+        return unique_uid(pack_uid(run[mask], event[mask]))[0]
+
+    def merge(self, state1, state2):
+        return union1d(*promote_uid(state1, state2))
+
+    def result(self, state):
+        return state.size
+
+
+# Sum of weights of the selected candidates, and sum of squared weights for
+# the uncertainties. 'weight' is an expression. The initial number of a
+# cutflow can be given as a state, i.e. (sumw, sumw2), otherwise efficiencies
+# relative to it are undefined.
+class CutflowWeightedCounter(CutflowCounter):
+    def __init__(self, weight):
+        self.branches = [weight]
+
+    def empty(self):
+        return zeros(2)
+
+    def chunk(self, mask, weight):
+        weight = broadcast_to(weight, mask.shape)[mask].astype(float)
+        return array([weight.sum(), (weight*weight).sum()])
+
+    def result(self, state):
+        return state[0]
+
+    def columns(self, state):
+        return {'sumw2': state[1]}
+
+
+##############
+# Efficiency #
+##############
+
+EFF_CL = 0.6827  # 1 sigma
+
+
+# Binomial efficiency and its uncertainty. With 'sumw2's, the uncertainty of
+# weighted counts is used, assuming the passing candidates are a subset of the
+# total.
+def eff_binomial(num_pass, num_total, sumw2_pass=None, sumw2_total=None):
+    if not num_total:
+        return nan, nan
+
+    eff = num_pass / num_total
+    if not 0 <= eff <= 1:  # Not a subset, e.g. for explicit rules
+        return eff, nan
+
+    if sumw2_pass is None:
+        return eff, sqrt(eff*(1-eff)/num_total)
+
+    var = (1-2*eff)*sumw2_pass + eff*eff*sumw2_total
+    return eff, sqrt(abs(var))/num_total
+
+
+# Clopper-Pearson interval. For weighted counts, the effective number of
+# entries is used.
+def eff_clopper_pearson(num_pass, num_total, sumw2_total=None, cl=EFF_CL):
+    if not num_total or not 0 <= num_pass <= num_total:
+        return nan, nan
+
+    if sumw2_total:
+        num_eff = num_total*num_total / sumw2_total
+        num_pass, num_total = num_pass / num_total * num_eff, num_eff
+
+    alpha = (1-cl) / 2
+    low = beta.ppf(alpha, num_pass, num_total-num_pass+1) if num_pass > 0 \
+        else 0.
+    high = beta.ppf(1-alpha, num_pass+1, num_total-num_pass) \
+        if num_pass < num_total else 1.
+    return low, high
+
+
+def cutflow_stream_states(ntp, tree, rules, counter, step_size, kwargs):
+    return CutflowGen(ntp, tree, rules, 0, **kwargs).stream_states(
+        counter, step_size)
+
+
 @dataclass
 class CutflowRule:
     cond: str = 'true'
@@ -35,46 +169,168 @@ class CutflowRule:
     key: Optional[str] = None
 
 
+# Masks that are kept for later rules can be stored as packed bits, which
+# takes 1/8 of the memory of a boolean array.
+def pack_mask(mask):
+    if isinstance(mask, ndarray) and mask.ndim == 1:
+        return packbits(mask), mask.size
+    return mask
+
+
+def unpack_mask(packed):
+    if isinstance(packed, tuple):
+        bits, size = packed
+        return unpackbits(bits, count=size).astype(bool)
+    return packed
+
+
 class CutflowGen:
-    def __init__(self, ntp_path, tree, rules, init_num, **kwargs):
+    def __init__(self, ntp_path, tree, rules, init_num, debug=False,
+                 **kwargs):
         self.rules = self.strip_multiline_str(rules)
         self.init_num = init_num
 
         self.ntp = ntp_path
         self.tree = tree
         self.exe = BooleanEvaluator(self.ntp, tree, **kwargs)
+        self.exe_kwargs = kwargs
 
+        # Only retain all raw outputs in debug mode
+        self.debug = debug
         self.debug_raw_output = []
 
-    def do(self, output_regulator=lambda ntp, tree, arr: sum(arr)):
-        ref = {}
-        result = {}
+    # The 'output_regulator' is either a 'CutflowCounter', or a function that
+    # computes the output from the array of boolean of a rule.
+    def do(self, output_regulator=lambda ntp, tree, arr: sum(arr),
+           pack=False, efficiency=False):
+        counter = self.regulate_counter(output_regulator)
+        states = []
+
+        # Read all branches needed by the rules and the counter in one go
+        self.exe.preload([r.cond for r in self.rules] + counter.branches)
+        branches = [self.exe.eval(b) for b in counter.branches]
+
+        # Note that 'raw_output' is an array of boolean
+        for raw_output in self.chain(
+                (self.exe.eval(r.cond) for r in self.rules), pack):
+            if self.debug:
+                self.debug_raw_output.append(raw_output)
+
+            if True in raw_output:
+                states.append(counter.chunk(raw_output, *branches))
+            else:
+                states.append(counter.empty())
+
+        return self.tabulate(counter, states, efficiency)
+
+    # Evaluate all rules chunk by chunk. The 'output_regulator' is either a
+    # 'CutflowCounter', or a regular function that is additive across chunks,
+    # like the default 'sum'. With 'workers', each file is processed in a
+    # thread/process pool.
+    def do_stream(self, output_regulator=CutflowCounter(),
+                  step_size=STEP_SIZE, workers=None, pool='thread',
+                  efficiency=False):
+        counter = self.regulate_counter(output_regulator)
+
+        if workers and isinstance(regulate_input(self.ntp, self.tree), list):
+            with POOLS[pool](max_workers=workers) as exe:
+                states_per_file = list(exe.map(
+                    cutflow_stream_states, self.ntp, repeat(self.tree),
+                    repeat(self.rules), repeat(counter), repeat(step_size),
+                    repeat(self.exe_kwargs)))
+        else:
+            states_per_file = [self.stream_states(counter, step_size)]
+
+        states = []
+        for states_rule in zip(*states_per_file):
+            state = counter.empty()
+            for st in states_rule:
+                if st is not None:
+                    state = counter.merge(state, st)
+            states.append(state)
+
+        return self.tabulate(counter, states, efficiency)
+
+    def regulate_counter(self, output_regulator):
+        if isinstance(output_regulator, CutflowCounter):
+            return output_regulator
+        return CutflowFuncCounter(output_regulator, self.ntp, self.tree)
+
+    # Per-rule counter states, merged over all chunks. A state is None if no
+    # candidate passed the rule.
+    def stream_states(self, counter, step_size=STEP_SIZE):
+        states = [None]*len(self.rules)
+        num_of_rules = len(self.rules)
+
+        for result in self.exe.iter_eval(
+                [r.cond for r in self.rules] + counter.branches, step_size):
+            raw_outputs, branches = result[:num_of_rules], \
+                result[num_of_rules:]
+
+            for idx, raw_output in enumerate(self.chain(raw_outputs)):
+                if True in raw_output:
+                    state = counter.chunk(raw_output, *branches)
+                    states[idx] = state if states[idx] is None else \
+                        counter.merge(states[idx], state)
 
+        return states
+
+    # Index of the rule each rule is compared to, or None if it is compared to
+    # the initial number of events/candidates.
+    def find_prev_idx(self):
+        result = []
         for idx, r in enumerate(self.rules):
             prev_idx = self.find_idx(idx, r.compare_to)
+            result.append(prev_idx if 0 <= prev_idx < idx else None)
+        return result
+
+    # Combine the raw output of each rule with the one it is compared to. Only
+    # the masks that later rules refer to are kept, and only for as long as
+    # they are needed.
+    def chain(self, raw_outputs, pack=False):
+        prev_idxs = self.find_prev_idx()
+        last_use = {p: idx for idx, p in enumerate(prev_idxs) if p is not None}
+        kept = {}
+
+        for idx, (r, raw_output, prev_idx) in enumerate(
+                zip(self.rules, raw_outputs, prev_idxs)):
+            prev_raw_output = True if prev_idx is None else \
+                unpack_mask(kept[prev_idx])
 
-            # If the 'output' entry does not exist, use the default initial
-            # number of events/candidates.
-            try:
-                prev_output = ref[self.rules[prev_idx].cond]['output']
-                prev_raw_output = ref[self.rules[prev_idx].cond]['raw_output']
-            except Exception:
-                prev_output = self.init_num
-                prev_raw_output = True
-
-            # Note that 'raw_output' is an array of boolean
-            raw_output = self.exe.eval(r.cond)
             if not r.explicit:
                 raw_output = AND(prev_raw_output, raw_output)
-            self.debug_raw_output.append(raw_output)
 
-            # Here, 'output' is a number
-            if True in raw_output:
-                output = output_regulator(self.ntp, self.tree, raw_output)
-            else:
-                output = 0
+            if idx in last_use:
+                kept[idx] = pack_mask(raw_output) if pack else raw_output
+            if prev_idx is not None and last_use[prev_idx] == idx:
+                del kept[prev_idx]
+
+            yield raw_output
+
+    def tabulate(self, counter, states, efficiency=False):
+        result = {}
+        outputs = [counter.result(st) for st in states]
+        columns = [counter.columns(st) for st in states]
+        init_output, init_columns = self.init_result(counter)
 
-            cut_result = {'input': prev_output, 'output': output}
+        for r, output, col, prev_idx in zip(
+                self.rules, outputs, columns, self.find_prev_idx()):
+            # If there's no previous rule, use the default initial number of
+            # events/candidates.
+            cut_result = {
+                'input': init_output if prev_idx is None else
+                outputs[prev_idx],
+                'output': output
+            }
+
+            prev_col = init_columns if prev_idx is None else columns[prev_idx]
+            for k, v in col.items():
+                cut_result[f'output_{k}'] = v
+                if k in prev_col:
+                    cut_result[f'input_{k}'] = prev_col[k]
+
+            if efficiency:
+                self.add_efficiency(cut_result)
 
             if r.name:
                 cut_result['name'] = r.name
@@ -84,13 +340,38 @@ class CutflowGen:
             else:
                 result[r.cond] = cut_result
 
-            # Include the raw array of boolean in the reference.
-            ref_cut_result = deepcopy(cut_result)
-            ref_cut_result['raw_output'] = raw_output
-            ref[r.cond] = ref_cut_result
-
         return result
 
+    # The initial number of events/candidates as (output, columns). For a
+    # weighted counter, it's only meaningful if given as (sumw, sumw2).
+    def init_result(self, counter):
+        if isinstance(counter, CutflowWeightedCounter) and \
+                isinstance(self.init_num, (tuple, list, ndarray)):
+            state = array(self.init_num, dtype=float)
+            return counter.result(state), counter.columns(state)
+        return self.init_num, {}
+
+    # Weighted outputs without the sum of squared weights of the input, e.g.
+    # compared to a plain initial number, have no meaningful efficiency.
+    @staticmethod
+    def add_efficiency(cut_result):
+        num_pass, num_total = cut_result['output'], cut_result['input']
+        sumw2_pass = cut_result.get('output_sumw2')
+        sumw2_total = cut_result.get('input_sumw2')
+
+        if sumw2_pass is not None and sumw2_total is None:
+            cut_result['eff'] = cut_result['eff_err'] = nan
+            if beta is not None:
+                cut_result['eff_low'] = cut_result['eff_high'] = nan
+            return
+
+        cut_result['eff'], cut_result['eff_err'] = eff_binomial(
+            num_pass, num_total, sumw2_pass, sumw2_total)
+
+        if beta is not None:
+            cut_result['eff_low'], cut_result['eff_high'] = \
+                eff_clopper_pearson(num_pass, num_total, sumw2_total)
+
     @staticmethod
     def find_idx(ref_idx, raw_idx):
         if isinstance(raw_idx, str):  # relative index
@@ -2,39 +2,689 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Tue Jun 21, 2022 at 02:06 PM -0400
+# Last Change: Sun Oct 18, 2026 at 11:55 PM -0400
 
+import os
+import os.path as osp
+import re
+import json
 import numpy as np
 
-from collections.abc import Iterable
-from uproot import concatenate
+from collections import OrderedDict
+from collections.abc import Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from hashlib import sha1
+from itertools import repeat
+from time import perf_counter
+from uproot import concatenate, iterate, open as open_root
+from uproot.behaviors.TBranch import HasBranches
 
 ARRAY_TYPE = 'np'
+STEP_SIZE = '100 MB'
+POOLS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+CACHE_SIZE = 10*1024**3  # in bytes
+LAZY_SIZE = 1024**3  # in bytes
 
 
 def regulate_input(ntp, tree):
+    # NOTE: Already-opened trees are used as they are
+    if isinstance(ntp, HasBranches):
+        return ntp
     if isinstance(ntp, str):
+        if is_snapshot(ntp):
+            return open_snapshot(ntp)[tree]
         return f'{ntp}:{tree}'
-    if isinstance(ntp, Iterable):
+    if isinstance(ntp, SnapshotTree):
+        return ntp
+    # NOTE: Opened ROOT files are mappings, and thus also iterables
+    if isinstance(ntp, Iterable) and not isinstance(ntp, Mapping):
         return [regulate_input(i, tree) for i in ntp]
     return ntp[tree]
 
 
-def read_branch(ntp, tree, branch, idx=None):
-    data = list(concatenate(
-        regulate_input(ntp, tree), branch, library=ARRAY_TYPE).values())[0]
+def read_branch(ntp, tree, branch, idx=None, **kwargs):
+    data = list(read_branches_dict(ntp, tree, branch, **kwargs).values())[0]
 
     return data if not idx else data[idx]
 
 
-def read_branches_dict(ntp, tree, branches):
-    return concatenate(regulate_input(ntp, tree), branches, library=ARRAY_TYPE)
+# Read multiple files in a thread/process pool if 'workers' is set. Each file
+# is decompressed in parallel and the result is concatenated in file order.
+# If 'timing' is a list, (file, seconds spent) is appended for each file.
+# If 'cache' (or the global cache, see 'enable_branch_cache') is set,
+# branches of local files are served from/stored to the on-disk cache.
+# 'entry_start' and 'entry_stop' count entries across all files, and only
+# the baskets in range are read. If 'cut' is set, only passing entries are
+# returned, see 'read_branches_dict_cut'.
+def read_branches_dict(ntp, tree, branches, workers=None, pool='thread',
+                       timing=None, cache=None, entry_start=None,
+                       entry_stop=None, cut=None, step_size=STEP_SIZE):
+    if cut is not None:
+        return read_branches_dict_cut(
+            ntp, tree, branches, cut, step_size, entry_start, entry_stop,
+            workers=workers, pool=pool, timing=timing, cache=cache)
 
+    src = regulate_input(ntp, tree)
+    cache = BRANCH_CACHE if cache is None else cache
+    ranged = entry_start is not None or entry_stop is not None
+    if isinstance(src, SnapshotTree) and not ranged:
+        return src.arrays(branches)
+    if not workers and timing is None and cache is None and not ranged and \
+            not has_snapshot(src):
+        return concatenate(src, branches, library=ARRAY_TYPE)
 
-def read_branches(ntp, tree, branches, idx=None, transpose=False):
-    data = list(read_branches_dict(ntp, tree, branches).values())
+    specs = src if isinstance(src, list) else [src]
+    if ranged:
+        specs, ranges = zip(*split_entry_range(specs, entry_start, entry_stop))
+    else:
+        ranges = [(None, None)]*len(specs)
+
+    if workers:
+        # NOTE: Already-opened files can't be sent to a process pool
+        with POOLS[pool](max_workers=workers) as exe:
+            results = list(exe.map(read_file_timed, specs, repeat(branches),
+                                   repeat(cache), ranges))
+    else:
+        results = [read_file_timed(s, branches, cache, r)
+                   for s, r in zip(specs, ranges)]
+
+    if timing is not None:
+        timing += [(s, t) for s, (_, t) in zip(specs, results)]
+
+    # NOTE: Don't copy single-file results, so cached branches stay mmap'ed
+    if len(results) == 1:
+        return results[0][0]
+    return {k: np.concatenate([d[k] for d, _ in results])
+            for k in results[0][0]}
+
+
+# The cut is evaluated chunk by chunk first, then 'branches' are only read
+# in clusters with passing entries, so that neither the full branches nor the
+# branches needed by the cut are ever fully in memory. Files are processed
+# one by one (or in a pool if 'workers' is set), each opened once.
+# NOTE: With an entry range, files are opened once more to count entries
+def read_branches_dict_cut(ntp, tree, branches, cut, step_size=STEP_SIZE,
+                           entry_start=None, entry_stop=None, workers=None,
+                           pool='thread', timing=None, cache=None):
+    # NOTE: Imported here to avoid a circular import
+    from .boolean.eval import BooleanEvaluator
+
+    kwargs = {'workers': workers, 'pool': pool, 'timing': timing,
+              'cache': cache}
+    exe = BooleanEvaluator(ntp, tree, memo_size=0)
+    cut_tree = exe.parse(cut)
+    if not exe.find_vars(cut_tree):
+        if exe.transform(cut_tree, exe.transformer):
+            return read_branches_dict(
+                ntp, tree, branches, entry_start=entry_start,
+                entry_stop=entry_stop, **kwargs)
+        return read_branches_dict(
+            ntp, tree, branches, entry_start=0, entry_stop=0, **kwargs)
+
+    src = regulate_input(ntp, tree)
+    specs = src if isinstance(src, list) else [src]
+    if entry_start is not None or entry_stop is not None:
+        specs, ranges = zip(*split_entry_range(specs, entry_start, entry_stop))
+    else:
+        ranges = [(None, None)]*len(specs)
+
+    cache = BRANCH_CACHE if cache is None else cache
+    if workers:
+        with POOLS[pool](max_workers=workers) as exe:
+            results = list(exe.map(read_file_cut, specs, repeat(branches),
+                                   repeat(cut), ranges, repeat(step_size),
+                                   repeat(cache)))
+    else:
+        results = [read_file_cut(s, branches, cut, r, step_size, cache)
+                   for s, r in zip(specs, ranges)]
+
+    if timing is not None:
+        timing += [(s, t) for s, (_, t) in zip(specs, results)]
+
+    results = [d for d, _ in results if d is not None]
+    if not results:
+        return read_branches_dict(
+            ntp, tree, branches, entry_start=0, entry_stop=0, **kwargs)
+    if len(results) == 1:
+        return results[0]
+    return {k: np.concatenate([d[k] for d in results]) for k in results[0]}
+
+
+# Evaluate 'cut' on a single file, then read the passing entries of
+# 'branches'. Returns (None, seconds spent) if no entry passes.
+def read_file_cut(spec, branches, cut, entry_range=(None, None),
+                  step_size=STEP_SIZE, cache=None):
+    # NOTE: Imported here to avoid a circular import
+    from .boolean.eval import BooleanEvaluator
+
+    start = perf_counter()
+    src = open_root(spec) if isinstance(spec, str) else spec
+    try:
+        exe = BooleanEvaluator(src, None, memo_size=0,
+                               entry_start=entry_range[0],
+                               entry_stop=entry_range[1])
+        mask = [np.asarray(m, dtype=bool)
+                for m in exe.iter_eval(cut, step_size)]
+        mask = np.concatenate(mask) if mask else np.zeros(0, dtype=bool)
+
+        data = None
+        if mask.any():
+            data, _ = read_file_masked(spec if cache is not None else src,
+                                       branches, entry_range[0] or 0, mask,
+                                       cache)
+    finally:
+        if src is not spec:
+            src.file.close()
+
+    return data, perf_counter() - start
+
+
+# Read the entries of a single file passing 'mask', which starts at local
+# entry 'entry_start'. For ROOT files, only the clusters (entry ranges where
+# all branches start a new basket) with passing entries are read, merging
+# adjacent clusters into a single read. Cached branches and snapshots are
+# mmap'ed anyway, so they're just masked.
+def read_file_masked(spec, branches, entry_start, mask, cache=None):
+    start = perf_counter()
+    branches = [branches] if isinstance(branches, str) else list(branches)
+    entries = entry_start + np.flatnonzero(mask)
+    span = (int(entries[0]), int(entries[-1]) + 1)
+
+    if cache is not None or isinstance(spec, SnapshotTree):
+        data, _ = read_file_timed(spec, branches, cache, span)
+        return {k: v[entries - span[0]] for k, v in data.items()}, \
+            perf_counter() - start
+
+    src = open_root(spec) if isinstance(spec, str) else spec
+    try:
+        parts = []
+        for lo, hi in cluster_ranges(src, branches, entries):
+            sel = entries[(entries >= lo) & (entries < hi)] - lo
+            data = src.arrays(branches, entry_start=lo, entry_stop=hi,
+                              library=ARRAY_TYPE)
+            parts.append({k: v[sel] for k, v in data.items()})
+    finally:
+        if src is not spec:
+            src.file.close()
+
+    if len(parts) == 1:
+        return parts[0], perf_counter() - start
+    return {k: np.concatenate([d[k] for d in parts]) for k in parts[0]}, \
+        perf_counter() - start
+
+
+# Entry ranges (start, stop) of runs of consecutive clusters that contain
+# 'entries', i.e. gaps smaller than a cluster are read through.
+def cluster_ranges(src, branches, entries):
+    bounds = src[branches[0]].entry_offsets
+    for br in branches[1:]:
+        bounds = np.intersect1d(bounds, src[br].entry_offsets)
+    bounds = np.asarray(bounds)
+
+    needed = np.unique(np.searchsorted(bounds, entries, side='right') - 1)
+    breaks = np.flatnonzero(np.diff(needed) > 1)
+    firsts = np.concatenate([needed[:1], needed[breaks+1]])
+    lasts = np.concatenate([needed[breaks], needed[-1:]])
+
+    return list(zip(bounds[firsts].tolist(), bounds[lasts+1].tolist()))
+
+
+def read_branches(ntp, tree, branches, idx=None, transpose=False, **kwargs):
+    data = list(read_branches_dict(ntp, tree, branches, **kwargs).values())
 
     if idx is not None:
         data = [d[idx] for d in data]
 
     return np.column_stack(data) if transpose else data
+
+
+def read_file_timed(spec, branches, cache=None, entry_range=(None, None)):
+    start = perf_counter()
+    if cache is not None:
+        # NOTE: Full branches are cached, so that any range can be served
+        data = cache.read(spec, branches)
+        if entry_range != (None, None):
+            data = {k: v[slice(*entry_range)] for k, v in data.items()}
+    else:
+        data = read_source(spec, branches, *entry_range)
+    return data, perf_counter() - start
+
+
+def read_source(spec, branches, entry_start=None, entry_stop=None):
+    if isinstance(spec, SnapshotTree):
+        return spec.arrays(branches, entry_start, entry_stop)
+    if entry_start is None and entry_stop is None:
+        return concatenate(spec, branches, library=ARRAY_TYPE)
+
+    branches = [branches] if isinstance(branches, str) else branches
+    src = open_root(spec) if isinstance(spec, str) else spec
+    try:
+        return src.arrays(branches, entry_start=entry_start,
+                          entry_stop=entry_stop, library=ARRAY_TYPE)
+    finally:
+        if src is not spec:
+            src.file.close()
+
+
+def num_entries(spec):
+    if not isinstance(spec, str):
+        return spec.num_entries
+
+    src = open_root(spec)
+    try:
+        return src.num_entries
+    finally:
+        src.file.close()
+
+
+# Split a global entry range into (spec, (local start, local stop)) for each
+# file that overlaps with the range. Negative indices count from the end.
+def split_entry_range(specs, entry_start=None, entry_stop=None):
+    sizes = [num_entries(s) for s in specs]
+    start, stop, _ = slice(entry_start, entry_stop).indices(sum(sizes))
+
+    result = []
+    offset = 0
+    for spec, size in zip(specs, sizes):
+        local_start = min(max(start - offset, 0), size)
+        local_stop = min(max(stop - offset, 0), size)
+        if local_start < local_stop:
+            result.append((spec, (local_start, local_stop)))
+        offset += size
+
+    # Keep one empty range, so that the result still has all branches
+    return result if result else [(specs[0], (0, 0))]
+
+
+###################
+# Lazy branch map #
+###################
+# A drop-in replacement for the dict returned by 'read_branches_dict': each
+# branch is read on first access and kept in a LRU cache capped by total
+# size in bytes. Non-array values (e.g. known symbols) are never evicted.
+# NOTE: 'in' only checks the branches currently in memory
+
+class LazyBranches(Mapping):
+    def __init__(self, ntp, tree, max_size=LAZY_SIZE, **kwargs):
+        self.ntp = ntp
+        self.tree = tree
+        self.max_size = max_size
+        self.read_kwargs = kwargs
+        self.size = 0
+        self.reads = 0
+        self.data = OrderedDict()
+        self.symbols = {}
+
+    def __getitem__(self, key):
+        if key in self.symbols:
+            return self.symbols[key]
+        if key in self.data:
+            self.data.move_to_end(key)
+            return self.data[key]
+
+        self.reads += 1
+        val = read_branches_dict(
+            self.ntp, self.tree, [key], **self.read_kwargs)[key]
+        self[key] = val
+        return val
+
+    def __setitem__(self, key, val):
+        if not isinstance(val, np.ndarray):
+            self.symbols[key] = val
+            return
+        if key in self.data:
+            self.size -= self.data.pop(key).nbytes
+
+        self.data[key] = val
+        self.size += val.nbytes
+
+        # Always keep the latest branch, even if it's over the limit alone
+        while self.size > self.max_size and len(self.data) > 1:
+            _, evicted = self.data.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def __contains__(self, key):
+        return key in self.symbols or key in self.data
+
+    def __iter__(self):
+        yield from self.symbols
+        yield from self.data
+
+    def __len__(self):
+        return len(self.symbols) + len(self.data)
+
+    def update(self, other):
+        for key, val in other.items():
+            self[key] = val
+
+    def clear(self):
+        self.data.clear()
+        self.size = 0
+
+
+################
+# Branch cache #
+################
+# Decompressed branches are stored as one .npy file per (file, tree, branch)
+# and memory-mapped on later reads. A file is keyed by its absolute path,
+# mtime and size, so a rewritten ntuple never hits stale entries.
+# The total size is capped by evicting the least recently used entries.
+# NOTE: Cached arrays are read-only memmaps
+
+# NOTE: The total size is tracked in memory, so the cache directory is only
+#       scanned once it may exceed 'max_size'. It's then trimmed down to
+#       'low_water' of 'max_size', so that not every later write rescans it.
+class BranchCache(object):
+    def __init__(self, cache_dir, max_size=CACHE_SIZE, low_water=0.9):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.low_water = low_water
+        self.size = None  # unknown until the first write
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path, tree, branch):
+        stat = os.stat(path)
+        raw = '\0'.join([osp.abspath(path), str(stat.st_mtime_ns),
+                          str(stat.st_size), tree, branch])
+        return osp.join(self.cache_dir, sha1(raw.encode()).hexdigest()+'.npy')
+
+    def get(self, path, tree, branch):
+        filename = self.key(path, tree, branch)
+        try:
+            data = np.load(filename, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # Mark as recently used. This may fail on a read-only cache, or if the
+        # file was evicted meanwhile, which the mapping survives
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return data
+
+    def put(self, path, tree, branch, data):
+        # NOTE: Jagged branches are object arrays that need pickling
+        if data.dtype.hasobject:
+            return
+
+        filename = self.key(path, tree, branch)
+        replaced = osp.getsize(filename) if osp.isfile(filename) else 0
+        tmp = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp, filename)  # atomic, in case of concurrent writers
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.scan())
+        else:
+            self.size += osp.getsize(filename) - replaced
+
+        if self.size > self.max_size:
+            self.evict()
+
+    # (mtime, size, path) of all cached branches
+    def scan(self):
+        entries = []
+        for e in os.scandir(self.cache_dir):
+            if e.name.endswith('.npy'):
+                try:
+                    stat = e.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, e.path))
+        return entries
+
+    # NOTE: Other processes may share the cache directory, so the tracked size
+    #       is refreshed from disk here
+    def evict(self):
+        entries = self.scan()
+        total = sum(e[1] for e in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size*self.low_water:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self.size = total
+
+    def clear(self):
+        for e in os.scandir(self.cache_dir):
+            if e.name.endswith('.npy'):
+                os.remove(e.path)
+        self.size = 0
+
+    def read(self, spec, branches):
+        # NOTE: Remote files, globs and opened trees are never cached
+        path, tree = spec.rsplit(':', 1) if isinstance(spec, str) else ('', '')
+        if not osp.isfile(path):
+            return read_source(spec, branches)
+
+        branches = [branches] if isinstance(branches, str) else list(branches)
+        data = {br: self.get(path, tree, br) for br in branches}
+
+        missing = [br for br, val in data.items() if val is None]
+        if missing:
+            loaded = concatenate(spec, missing, library=ARRAY_TYPE)
+            for br in missing:
+                self.put(path, tree, br, loaded[br])
+                data[br] = loaded[br]
+
+        return data
+
+
+BRANCH_CACHE = None
+
+
+def enable_branch_cache(cache_dir, max_size=CACHE_SIZE):
+    global BRANCH_CACHE
+    BRANCH_CACHE = BranchCache(cache_dir, max_size)
+    return BRANCH_CACHE
+
+
+def disable_branch_cache():
+    global BRANCH_CACHE
+    BRANCH_CACHE = None
+
+
+#############
+# Streaming #
+#############
+# These yield the data chunk by chunk, so that the peak memory usage depends
+# on 'step_size' (number of entries, or a size string like '100 MB'), not on
+# the size of the dataset.
+
+def iter_branches(ntp, tree, branches, step_size=STEP_SIZE, entry_start=None,
+                  entry_stop=None):
+    src = regulate_input(ntp, tree)
+    ranged = entry_start is not None or entry_stop is not None
+
+    # NOTE: 'uproot.iterate' doesn't work with already-opened trees
+    if not ranged and not hasattr(src, 'iterate') and not has_snapshot(src):
+        yield from iterate(src, branches, step_size=step_size,
+                           library=ARRAY_TYPE)
+        return
+
+    specs = src if isinstance(src, list) else [src]
+    if ranged:
+        ranges = split_entry_range(specs, entry_start, entry_stop)
+    else:
+        ranges = [(s, (None, None)) for s in specs]
+
+    for spec, (start, stop) in ranges:
+        yield from iter_source(spec, branches, step_size, start, stop)
+
+
+def iter_source(spec, branches, step_size=STEP_SIZE, entry_start=None,
+                entry_stop=None):
+    if entry_start is not None and entry_start == entry_stop:
+        return
+
+    src = open_root(spec) if isinstance(spec, str) else spec
+    try:
+        yield from src.iterate(branches, step_size=step_size,
+                               entry_start=entry_start, entry_stop=entry_stop,
+                               library=ARRAY_TYPE)
+    finally:
+        if src is not spec:
+            src.file.close()
+
+
+def iter_branch(ntp, tree, branch, step_size=STEP_SIZE, **kwargs):
+    for chunk in iter_branches(ntp, tree, [branch], step_size, **kwargs):
+        yield chunk[branch]
+
+
+#############
+# Snapshots #
+#############
+# A snapshot is a directory holding skimmed trees as raw binary columns, one
+# file per branch, plus a JSON manifest with the dtype and number of entries
+# of each column. Columns are memory-mapped on read, so loading a snapshot is
+# instant and only the pages actually touched are read from disk.
+# Snapshots can be used in place of ntuples: 'regulate_input' opens any
+# directory with a manifest as a snapshot.
+
+SNAPSHOT_MANIFEST = 'manifest.json'
+MEMORY_UNITS = {'b': 1, 'kb': 1000, 'mb': 1000**2, 'gb': 1000**3,
+                'kib': 1024, 'mib': 1024**2, 'gib': 1024**3}
+
+
+def is_snapshot(path):
+    return osp.isfile(osp.join(path, SNAPSHOT_MANIFEST))
+
+
+def open_snapshot(path):
+    return Snapshot(path)
+
+
+def has_snapshot(src):
+    return isinstance(src, list) and \
+        any(isinstance(s, SnapshotTree) for s in src)
+
+
+# Convert 'step_size' to number of entries, given the size of an entry
+def step_size_to_entries(step_size, entry_size):
+    if not isinstance(step_size, str):
+        return int(step_size)
+
+    match = re.match(r'^\s*([\d.]+)\s*([kmg]?i?b)\s*$', step_size.lower())
+    if not match:
+        raise ValueError(f'Unknown step size: {step_size}')
+
+    num_of_bytes = float(match.group(1)) * MEMORY_UNITS[match.group(2)]
+    return max(int(num_of_bytes // max(entry_size, 1)), 1)
+
+
+class Snapshot(Mapping):
+    def __init__(self, path):
+        self.path = path
+        with open(osp.join(path, SNAPSHOT_MANIFEST)) as f:
+            self.manifest = json.load(f)
+
+    def __getitem__(self, tree):
+        return SnapshotTree(self.path, tree, self.manifest[tree])
+
+    def __iter__(self):
+        return iter(self.manifest)
+
+    def __len__(self):
+        return len(self.manifest)
+
+
+class SnapshotTree(object):
+    def __init__(self, path, name, manifest):
+        self.path = path
+        self.name = name
+        self.num_entries = manifest['entries']
+        self.columns = manifest['branches']
+
+    def keys(self):
+        return list(self.columns)
+
+    def array(self, branch):
+        col = self.columns[branch]
+        dtype = np.dtype(col['dtype'])
+        # NOTE: Empty files can't be memory-mapped
+        if not self.num_entries:
+            return np.empty(0, dtype)
+        return np.memmap(osp.join(self.path, col['file']), dtype=dtype,
+                         mode='r', shape=(self.num_entries,))
+
+    def arrays(self, branches, entry_start=None, entry_stop=None, **kwargs):
+        branches = [branches] if isinstance(branches, str) else branches
+        return {br: self.array(br)[entry_start:entry_stop] for br in branches}
+
+    def iterate(self, branches, step_size=STEP_SIZE, entry_start=None,
+                entry_stop=None, **kwargs):
+        data = self.arrays(branches, entry_start, entry_stop)
+        if not data:
+            return
+
+        size = len(next(iter(data.values())))
+        entry_size = sum(d.dtype.itemsize for d in data.values())
+        step = step_size_to_entries(step_size, entry_size)
+        for start in range(0, size, step):
+            yield {k: v[start:start+step] for k, v in data.items()}
+
+
+# Skim 'branches' (which can also be expressions) from 'ntp' into a snapshot
+# in 'output', keeping only entries passing 'cut'. Data is processed chunk by
+# chunk, so the skim never has to fit in memory.
+def snapshot(ntp, tree, branches, cut=None, output='snapshot',
+             step_size=STEP_SIZE):
+    # NOTE: Imported here to avoid a circular import
+    from .boolean.eval import BooleanEvaluator
+
+    if not branches:
+        raise ValueError('No branch to snapshot')
+
+    exe = BooleanEvaluator(ntp, tree, memo_size=0)
+    exprs = list(branches) + ([cut] if cut else [])
+    rel_dir = tree.strip('/')
+    os.makedirs(osp.join(output, rel_dir), exist_ok=True)
+
+    columns = {br: {'file': osp.join(rel_dir, f'{i}.bin'), 'dtype': None}
+               for i, br in enumerate(branches)}
+    files = {br: open(osp.join(output, col['file']), 'wb')
+             for br, col in columns.items()}
+    entries = 0
+
+    try:
+        for result in exe.iter_eval(exprs, step_size):
+            # NOTE: Constant expressions evaluate to scalars, so take the
+            #       chunk length from the first one depending on a branch
+            size = next(len(r) for r in result if np.ndim(r))
+            sel = np.broadcast_to(result[-1], (size,)).astype(bool) if cut \
+                else np.ones(size, dtype=bool)
+
+            for br, val in zip(branches, result):
+                if not np.ndim(val):
+                    val = np.full(size, val)
+                val = val[sel]
+                if val.dtype.hasobject:
+                    raise ValueError(f'Can\'t snapshot jagged branch: {br}')
+                if columns[br]['dtype'] is None:
+                    columns[br]['dtype'] = val.dtype.str
+                files[br].write(np.ascontiguousarray(
+                    val, dtype=columns[br]['dtype']).tobytes())
+            entries += int(np.count_nonzero(sel))
+    finally:
+        for f in files.values():
+            f.close()
+
+    # Default dtype for empty input
+    for col in columns.values():
+        if col['dtype'] is None:
+            col['dtype'] = np.dtype(float).str
+
+    manifest = Snapshot(output).manifest if is_snapshot(output) else {}
+    manifest[tree] = {'entries': entries, 'branches': columns}
+    with open(osp.join(output, SNAPSHOT_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return Snapshot(output)[tree]
@@ -2,13 +2,17 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Tue Aug 23, 2022 at 04:54 AM -0400
+# Last Change: Sun Oct 18, 2026 at 10:30 PM -0400
 
 import numpy as np
 import matplotlib as mp
 
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from functools import wraps
 from inspect import getfullargspec
+from time import perf_counter
+from typing import Optional
 from matplotlib.figure import Figure
 
 
@@ -314,12 +318,32 @@ def plot_vlines(x, y, vlines_add_args,
 # 2D plots #
 ############
 
+# Options of 'ax.hist2d' that only make sense when binning raw data
+HIST2D_BINNING_ARGS = ('bins', 'range', 'density', 'weights', 'cmin', 'cmax')
+
+
+# With a precomputed 2D 'histo', 'x' and 'y' are its bin edges. Hexagons are
+# then filled with the contents of the rectangular bins whose centers they
+# contain, so the histogram should be finer than the hexagon grid. Empty bins
+# are skipped, so hexagons that only cover empty bins are left blank.
 @decorate_output
 def plot_hexbin(x, y, hexbin_add_args,
-                output=None, colorbar_label=None,
+                output=None, colorbar_label=None, histo=None,
                 **kwargs):
     fig, ax, legend = plot_prepare(**kwargs)
-    color_mesh = ax.hexbin(x, y,  **hexbin_add_args)
+
+    if histo is None:
+        color_mesh = ax.hexbin(x, y,  **hexbin_add_args)
+    else:
+        xc, yc = np.meshgrid(convert_bins_to_central_pos(x),
+                             convert_bins_to_central_pos(y), indexing='ij')
+        histo = np.asarray(histo)
+        filled = histo != 0
+        add_args = {'reduce_C_function': np.sum,
+                    'extent': (x[0], x[-1], y[0], y[-1]), **hexbin_add_args}
+        color_mesh = ax.hexbin(xc[filled], yc[filled], C=histo[filled],
+                               **add_args)
+
     cb = fig.colorbar(color_mesh, ax=ax)
 
     if colorbar_label:
@@ -329,12 +353,22 @@ def plot_hexbin(x, y, hexbin_add_args,
     return output, fig, ax
 
 
+# With a precomputed 2D 'histo', e.g. from 'HistogramND', 'x' and 'y' are its
+# bin edges, and only O(bins) data is drawn.
 @decorate_output
 def plot_hist2d(x, y, hist2d_add_args,
-                output=None, colorbar_label=None,
+                output=None, colorbar_label=None, histo=None,
                 **kwargs):
     fig, ax, legend = plot_prepare(**kwargs)
-    _, _, _, color_mesh = ax.hist2d(x, y, **hist2d_add_args)
+
+    if histo is None:
+        _, _, _, color_mesh = ax.hist2d(x, y, **hist2d_add_args)
+    else:
+        add_args = {k: v for k, v in hist2d_add_args.items()
+                    if k not in HIST2D_BINNING_ARGS}
+        # NOTE: Same orientation as 'ax.hist2d', i.e. 'x' along the first axis
+        color_mesh = ax.pcolormesh(x, y, np.asarray(histo).T, **add_args)
+
     cb = fig.colorbar(color_mesh, ax=ax)
 
     if colorbar_label:
@@ -416,3 +450,84 @@ def plot_top_bot(top_plotters, bot_plotters,
     fig.align_ylabels()
 
     return fig, ax1, ax2
+
+
+###################
+# Batch rendering #
+###################
+# Plots are described by picklable specs of precomputed data and styling, so
+# that they can be rendered, mostly 'fig.savefig', in a process pool.
+
+PLOT_LAYERS = {
+    'histo': plot_histo,
+    'errorbar': plot_errorbar,
+    'step': plot_step,
+    'fill': plot_fill,
+    'hlines': plot_hlines,
+    'vlines': plot_vlines,
+    'hexbin': plot_hexbin,
+    'hist2d': plot_hist2d,
+}
+
+
+# Each layer is (kind, args) or (kind, args, kwargs), drawn with
+# 'PLOT_LAYERS[kind](*args, **kwargs)', e.g.
+#   ('histo', (bins, histo, ax_add_args_histo('data', 'black')))
+# If 'bot' is set, the plot is made with 'plot_top_bot' instead of 'plot_top'.
+# 'kwargs' are passed to 'plot_top'/'plot_top_bot'.
+@dataclass
+class PlotSpec:
+    output: str
+    top: list
+    bot: Optional[list] = None
+    kwargs: dict = field(default_factory=dict)
+
+
+def layer_plotter(layer):
+    kind, args, *rest = layer
+    kwargs = rest[0] if rest else {}
+    plotter = PLOT_LAYERS[kind]
+
+    return lambda fig, ax, **kw: plotter(
+        *args, figure=fig, axis=ax, **{'show_legend': False, **kwargs, **kw})
+
+
+def render_plot(spec):
+    start = perf_counter()
+    top = [layer_plotter(l) for l in spec.top]
+
+    if spec.bot is None:
+        plot_top(top, output=spec.output, **spec.kwargs)
+    else:
+        fig, *_ = plot_top_bot(top, [layer_plotter(l) for l in spec.bot],
+                               **spec.kwargs)
+        fig.savefig(spec.output)
+
+    return spec.output, perf_counter() - start
+
+
+def use_style(style=None):
+    if style:
+        import mplhep as hep
+        hep.style.use(style)
+
+
+def init_render_worker(style=None):
+    mp.use('Agg')
+    use_style(style)
+
+
+# Render many plots, in a process pool if 'workers' is set. Each worker uses
+# the Agg backend and loads the mplhep 'style' once. Returns
+# (output, seconds spent) for each spec, in order.
+def render_plots(specs, workers=None, style='LHCb2'):
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_render_worker,
+                                 initargs=(style,)) as exe:
+            return list(exe.map(render_plot, specs))
+
+    # NOTE: Don't leak the style to the caller
+    with mp.rc_context():
+        use_style(style)
+        return [render_plot(s) for s in specs]
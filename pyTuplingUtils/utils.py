@@ -2,16 +2,116 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Wed Mar 30, 2022 at 12:47 PM -0400
+# Last Change: Mon Oct 19, 2026 at 12:05 AM -0400
 
 import numpy as np
 
-from .io import read_branches
+import os.path as osp
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from itertools import zip_longest
+from tempfile import TemporaryDirectory
+
+from .io import read_branches, STEP_SIZE
+from .boolean.eval import BooleanEvaluator, JobPlanner
+
+
+UID_DTYPE = np.dtype([('run', np.uint64), ('event', np.uint64)])
+UID_SHIFT = np.uint64(32)
+UID_MASK = np.uint64(2**32 - 1)
+UID_HASH_RUN = np.uint64(0x9E3779B97F4A7C15)
+UID_HASH_EVENT = np.uint64(0xC2B2AE3D27D4EB4F)
+
+
+# Pack run and event numbers into one 64-bit integer if both fit in 32 bits,
+# or into a (run, event) record otherwise. Either way, UIDs are sorted by run
+# number first, then event number.
+def pack_uid(run, event):
+    # NOTE: Flatten, as selecting with a scalar 'True' adds an axis
+    run = np.ravel(run).astype(np.uint64)
+    event = np.ravel(event).astype(np.uint64)
+
+    if (run.size == 0 or run.max() <= UID_MASK) and \
+            (event.size == 0 or event.max() <= UID_MASK):
+        return (run << UID_SHIFT) | event
+
+    uid = np.empty(run.size, dtype=UID_DTYPE)
+    uid['run'] = run
+    uid['event'] = event
+    return uid
+
+
+def unpack_uid(uid):
+    if uid.dtype == UID_DTYPE:
+        return uid['run'], uid['event']
+    return uid >> UID_SHIFT, uid & UID_MASK
+
+
+# Make sure all packed UIDs share the same representation
+def promote_uid(*uids):
+    if all(u.dtype != UID_DTYPE for u in uids):
+        return uids
+
+    result = []
+    for u in uids:
+        if u.dtype != UID_DTYPE:
+            run, event = unpack_uid(u)
+            u = np.empty(u.size, dtype=UID_DTYPE)
+            u['run'] = run
+            u['event'] = event
+        result.append(u)
+    return tuple(result)
+
+
+# Sorted unique UIDs, with the index of their first occurrence and their
+# number of occurrences (or the sum of 'count' if given).
+def unique_uid(uid, count=None):
+    if uid.dtype == UID_DTYPE:
+        order = np.lexsort((uid['event'], uid['run']))
+        run, event = uid['run'][order], uid['event'][order]
+        changed = (run[1:] != run[:-1]) | (event[1:] != event[:-1])
+    else:
+        order = np.argsort(uid, kind='stable')
+        changed = uid[order][1:] != uid[order][:-1]
+
+    first = np.flatnonzero(np.concatenate([[uid.size > 0], changed]))
+
+    if count is None:
+        count = np.diff(np.append(first, uid.size))
+    elif uid.size:
+        count = np.add.reduceat(count[order], first)
+
+    return uid[order[first]], order[first], count
+
+
+# The legacy, human-readable '<run>-<event>' UIDs
+def gen_uid(run, event):
+    run = np.char.mod('%d', run)
+    event = np.char.mod('%d', event)
+
+    run = np.char.add(run, '-')
+    return np.char.add(run, event)
+
+
+def uid_to_str(uid):
+    return gen_uid(*unpack_uid(uid))
+
+
+def summarize_uid(uid, count, num_of_evt):
+    num_of_ids = uid.size
+    num_of_dupl_ids = uid[count > 1].size
+    # num_of_evt_w_dupl_id = np.sum(count[count > 1]) - num_of_dupl_ids
+    num_of_evt_w_dupl_id = num_of_evt - num_of_ids
+
+    return num_of_evt, num_of_ids, num_of_dupl_ids, num_of_evt_w_dupl_id
 
 
 # Find total number of events (unique events) out of total number of candidates.
+# UIDs are packed integers, unless 'as_str' is set.
 def extract_uid(ntp, tree, run_branch='runNumber', event_branch='eventNumber',
-                conditional=None, run_array=None, event_array=None):
+                conditional=None, run_array=None, event_array=None,
+                as_str=False):
     if run_array is None or event_array is None:
         run, event = read_branches(ntp, tree, (run_branch, event_branch))
     else:
@@ -21,44 +121,621 @@ def extract_uid(ntp, tree, run_branch='runNumber', event_branch='eventNumber',
         run = run[conditional]
         event = event[conditional]
 
-    run = np.char.mod('%d', run)
-    event = np.char.mod('%d', event)
+    if as_str:
+        ids = gen_uid(run, event)
+        uid, idx, count = np.unique(ids, return_index=True, return_counts=True)
+    else:
+        ids = pack_uid(run, event)
+        uid, idx, count = unique_uid(ids)
 
-    run = np.char.add(run, '-')
-    ids = np.char.add(run, event)
+    return (uid, idx) + summarize_uid(uid, count, ids.size)
 
-    uid, idx, count = np.unique(ids, return_index=True, return_counts=True)
 
-    num_of_evt = ids.size
-    num_of_ids = uid.size
-    num_of_dupl_ids = uid[count > 1].size
-    # num_of_evt_w_dupl_id = np.sum(count[count > 1]) - num_of_dupl_ids
-    num_of_evt_w_dupl_id = num_of_evt - num_of_ids
+def iter_run_event(ntp, tree, run_branch='runNumber',
+                   event_branch='eventNumber', cut=None, step_size=STEP_SIZE):
+    exe = BooleanEvaluator(ntp, tree)
+    exprs = [run_branch, event_branch] + ([cut] if cut else [])
+
+    for run, event, *cond in exe.iter_eval(exprs, step_size):
+        if cond:
+            run, event = run[cond[0]], event[cond[0]]
+        yield run, event
+
+
+# Same as 'extract_uid', but only the unique IDs are kept in memory; the
+# run/event numbers are read chunk by chunk. The optional 'cut' is a boolean
+# expression, evaluated on each chunk.
+def extract_uid_stream(ntp, tree, run_branch='runNumber',
+                       event_branch='eventNumber', cut=None,
+                       step_size=STEP_SIZE):
+    uids = [np.array([], dtype=np.uint64)]
+    idxs = [np.array([], dtype=np.int64)]
+    counts = [np.array([], dtype=np.int64)]
+    num_of_evt = 0
+
+    # NOTE: Only the per-chunk unique IDs are kept; they're merged in a single
+    #       pass at the end, as merging after each chunk is quadratic
+    for run, event in iter_run_event(
+            ntp, tree, run_branch, event_branch, cut, step_size):
+        # NOTE: Like in 'extract_uid', indices refer to the selected events
+        ids = pack_uid(run, event)
+        chunk_uid, chunk_idx, chunk_count = unique_uid(ids)
+
+        uids.append(chunk_uid)
+        idxs.append(chunk_idx+num_of_evt)
+        counts.append(chunk_count)
+        num_of_evt += ids.size
+
+    uid, first, count = unique_uid(
+        np.concatenate(promote_uid(*uids)), np.concatenate(counts))
+    idx = np.concatenate(idxs)[first]
+
+    return (uid, idx) + summarize_uid(uid, count, num_of_evt)
+
+
+# Count unique events out-of-core, for datasets whose unique IDs don't fit in
+# memory: UIDs are hash-partitioned into temporary files on disk chunk by
+# chunk, then each partition is counted separately. Returns the same counts as
+# 'extract_uid'.
+def count_uid_stream(ntp, tree, run_branch='runNumber',
+                     event_branch='eventNumber', cut=None,
+                     step_size=STEP_SIZE, partitions=64, tmp_dir=None):
+    num_of_evt = 0
+
+    with TemporaryDirectory(dir=tmp_dir) as tmp:
+        files = {}
+
+        for run, event in iter_run_event(
+                ntp, tree, run_branch, event_branch, cut, step_size):
+            uid = pack_uid(run, event)
+            part = (hash_uid(uid) % np.uint64(partitions)).astype(np.intp)
+            order = np.argsort(part, kind='stable')
+            bounds = np.cumsum(np.bincount(part, minlength=partitions))
+            num_of_evt += uid.size
+
+            # Narrow and wide UIDs go to separate files in each partition
+            for p, uid_p in enumerate(np.split(uid[order], bounds[:-1])):
+                key = (p, uid.dtype == UID_DTYPE)
+                if uid_p.size:
+                    if key not in files:
+                        files[key] = open(osp.join(tmp, f'{p}-{key[1]}'), 'wb')
+                    uid_p.tofile(files[key])
+
+        for f in files.values():
+            f.close()
+
+        num_of_ids = num_of_dupl_ids = 0
+        for p in range(partitions):
+            uid_p = [np.fromfile(f.name, dtype=UID_DTYPE if wide else np.uint64)
+                     for (q, wide), f in files.items() if q == p]
+            if not uid_p:
+                continue
+
+            uid_p, _, count_p = unique_uid(np.concatenate(promote_uid(*uid_p)))
+            num_of_ids += uid_p.size
+            num_of_dupl_ids += uid_p[count_p > 1].size
 
-    return uid, idx, num_of_evt, num_of_ids, \
-        num_of_dupl_ids, num_of_evt_w_dupl_id
+    return num_of_evt, num_of_ids, num_of_dupl_ids, num_of_evt - num_of_ids
+
+
+# Hash of the run and event numbers, independent of how they are packed
+def hash_uid(uid):
+    run, event = unpack_uid(uid)
+    # NOTE: The low bits of a multiplicative hash are poorly mixed
+    return ((run * UID_HASH_RUN) ^ (event * UID_HASH_EVENT)) >> UID_SHIFT
+
+
+# Merge two sets of sorted unique IDs, keeping the first occurrence index of
+# the former.
+def merge_uid(uid1, idx1, count1, uid2, idx2, count2):
+    uid, first, count = unique_uid(
+        np.concatenate(promote_uid(uid1, uid2)),
+        np.concatenate([count1, count2]))
+
+    return uid, np.concatenate([idx1, idx2])[first], count
+
+
+def intersect_uid(uid1, uid2):
+    return np.intersect1d(
+        *promote_uid(uid1, uid2), assume_unique=True, return_indices=True)
+
+
+# Sort-merge join of any number of sorted, unique UID arrays. Returns the
+# common UIDs, and for each input, the positions of the common UIDs in it.
+def join_uid(*uids):
+    uids = promote_uid(*uids)
+    uid_comm = uids[0]
+    pos = [np.arange(uid_comm.size)]
+
+    for u in uids[1:]:
+        uid_comm, pos_comm, pos_u = np.intersect1d(
+            uid_comm, u, assume_unique=True, return_indices=True)
+        pos = [p[pos_comm] for p in pos] + [pos_u]
+
+    return uid_comm, pos
+
+
+# Match unique events across multiple ntuples. Returns the common UIDs and,
+# for each ntuple, the indices of the matched candidates.
+def find_common_uid_multi(ntps, trees, **kwargs):
+    trees = [trees]*len(ntps) if isinstance(trees, str) else trees
+    uid_idx = [extract_uid(n, t, **kwargs)[0:2] for n, t in zip(ntps, trees)]
+    uid_comm, pos = join_uid(*[uid for uid, _ in uid_idx])
+
+    return uid_comm, [idx[p] for (_, idx), p in zip(uid_idx, pos)]
 
 
 def find_common_uid(ntp1, ntp2, tree1, tree2, **kwargs):
-    uid1, idx1 = extract_uid(ntp1, tree1, **kwargs)[0:2]
-    uid2, idx2 = extract_uid(ntp2, tree2, **kwargs)[0:2]
-    uid_comm, uid_comm_idx1, uid_comm_idx2 = np.intersect1d(
-        uid1, uid2, assume_unique=True, return_indices=True)
+    uid_comm, (idx1, idx2) = find_common_uid_multi(
+        [ntp1, ntp2], [tree1, tree2], **kwargs)
+
+    return uid_comm, idx1, idx2
+
+
+# Save the matching to a compressed '.npz' file, so that downstream jobs can
+# reuse it without recomputing it.
+def save_uid_match(path, uid_comm, idx):
+    np.savez_compressed(
+        path, uid=uid_comm, **{f'idx{i}': d for i, d in enumerate(idx)})
+
+
+def load_uid_match(path):
+    with np.load(path) as data:
+        num_of_inputs = len([k for k in data.keys() if k.startswith('idx')])
+        return data['uid'], [data[f'idx{i}'] for i in range(num_of_inputs)]
 
-    return uid_comm, idx1[uid_comm_idx1], idx2[uid_comm_idx2]
+
+HISTO_BLOCK_SIZE = 65536
+AUTO_RANGE_BUFFER = 64 * 1024**2  # in bytes
+AUTO_RANGE_FINE_FACTOR = 64
+
+
+# Fixed, uniform-bin histogram that is filled chunk by chunk, with optional
+# weights. Only the sums of weights (and of weights squared, for errors) per
+# bin are kept, and accumulators with the same binning can be merged, e.g.
+# across workers. Edges and sums are always float64, so results are identical
+# to 'np.histogram' only for float64 data and weights.
+class HistogramAccumulator(object):
+    def __init__(self, bins=200, data_range=(0, 1)):
+        lo, hi = (float(x) for x in data_range)
+        if lo == hi:  # same as 'np.histogram'
+            lo, hi = lo - 0.5, hi + 0.5
+        if not lo < hi:
+            raise ValueError(f'Invalid data range: {data_range}')
+
+        self.bins = bins
+        self.data_range = (lo, hi)
+        self.edges = np.linspace(lo, hi, bins+1)
+        self.norm = bins / (hi - lo)
+        self.sumw = np.zeros(bins)
+        self.sumw2 = np.zeros(bins)
+        self.weighted = False
+        self.entries = 0  # including those out of range
+
+    def bin_index(self, array):
+        lo, hi = self.data_range
+        keep = (array >= lo) & (array <= hi)
+        array = array[keep]
+
+        # NOTE: Correct for rounding at the edges, same as 'np.histogram'
+        idx = ((array - lo) * self.norm).astype(np.intp)
+        idx[idx == self.bins] -= 1
+        idx[array < self.edges[idx]] -= 1
+        idx[(array >= self.edges[idx+1]) & (idx != self.bins-1)] += 1
+        return idx, keep
+
+    # NOTE: Filled block by block so that temporaries stay in the CPU cache
+    def fill(self, array, weights=None):
+        array = np.ravel(array)
+        weights = None if weights is None else np.ravel(weights)
+        self.weighted |= weights is not None
+        self.entries += array.size
+
+        for start in range(0, array.size, HISTO_BLOCK_SIZE):
+            block = slice(start, start+HISTO_BLOCK_SIZE)
+            idx, keep = self.bin_index(array[block])
+
+            if weights is None:
+                counts = np.bincount(idx, minlength=self.bins)
+                self.sumw += counts
+                self.sumw2 += counts
+            else:
+                wt = weights[block][keep]
+                self.sumw += np.bincount(idx, wt, self.bins)
+                self.sumw2 += np.bincount(idx, wt*wt, self.bins)
+
+        return self
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Only histograms with the same binning merge.')
+
+        self.sumw += other.sumw
+        self.sumw2 += other.sumw2
+        self.weighted |= other.weighted
+        self.entries += other.entries
+        return self
+
+    @property
+    def errors(self):
+        return np.sqrt(self.sumw2)
+
+    # (histo, edges), same as 'np.histogram'
+    def result(self, density=False):
+        if density:
+            return self.sumw / np.diff(self.edges) / self.sumw.sum(), \
+                self.edges
+        if not self.weighted:
+            return self.sumw.astype(np.int64), self.edges
+        return self.sumw.copy(), self.edges
+
+
+# Streamed histogram with a range found from the data, padded the same way as
+# 'gen_histo'. Chunks are buffered until 'buffer_size' bytes, so that small
+# inputs give exactly the same result as 'gen_histo'. Beyond that, data goes
+# into a fine histogram ('fine_factor' times more bins) whose range doubles
+# whenever a chunk falls outside of it, by merging pairs of fine bins. In the
+# end the fine histogram is rebinned into the padded range, assuming a flat
+# distribution within each fine bin.
+class AutoRangeAccumulator(object):
+    def __init__(self, bins=200, scale=1.05, buffer_size=AUTO_RANGE_BUFFER,
+                 fine_factor=AUTO_RANGE_FINE_FACTOR):
+        self.bins = bins
+        self.scale = scale
+        self.buffer_size = buffer_size
+        self.fine_bins = bins * fine_factor
+        self.buffer = []
+        self.buffered = 0
+        self.fine = None
+        self.final = None
+        self.data_min = None
+        self.data_max = None
+        self.entries = 0
+
+    def fill(self, array, weights=None):
+        array = np.ravel(array)
+        self.entries += array.size
+        finite = array[np.isfinite(array)]
+        if not finite.size:
+            return self
+
+        chunk_min, chunk_max = finite.min(), finite.max()
+        self.data_min = chunk_min if self.data_min is None else \
+            min(self.data_min, chunk_min)
+        self.data_max = chunk_max if self.data_max is None else \
+            max(self.data_max, chunk_max)
+
+        self.final = None
+        if self.fine is None:
+            self.buffer.append((array, weights))
+            self.buffered += array.nbytes
+            if weights is not None:
+                self.buffered += np.asarray(weights).nbytes
+            if self.buffered > self.buffer_size:
+                self.spill()
+        else:
+            self.extend(chunk_min, chunk_max)
+            self.fine.fill(array, weights)
+
+        return self
+
+    def spill(self):
+        lo, hi = self.data_min, self.data_max
+        self.fine = HistogramAccumulator(
+            self.fine_bins, (lo, hi if hi > lo else lo + 1))
+
+        for arr, wt in self.buffer:
+            self.fine.fill(arr, wt)
+        self.buffer = []
+
+    # Double the width of the fine histogram until it covers [lo, hi]
+    def extend(self, lo, hi):
+        fine = self.fine
+        while lo < fine.data_range[0] or hi > fine.data_range[1]:
+            fine_lo, fine_hi = fine.data_range
+            width = fine_hi - fine_lo
+            grow_up = hi > fine_hi
+
+            new = HistogramAccumulator(
+                self.fine_bins, (fine_lo, fine_hi + width) if grow_up
+                else (fine_lo - width, fine_hi))
+            half = slice(0, self.fine_bins // 2) if grow_up \
+                else slice(self.fine_bins // 2, None)
+            new.sumw[half] = fine.sumw.reshape(-1, 2).sum(axis=1)
+            new.sumw2[half] = fine.sumw2.reshape(-1, 2).sum(axis=1)
+            new.weighted = fine.weighted
+            fine = new
+
+        self.fine = fine
+
+    @property
+    def data_range(self):
+        if self.data_min is None:
+            raise ValueError('Can\'t find the range without finite data.')
+        return pad_range(self.data_min, self.data_max, self.scale)
+
+    def result(self, density=False):
+        acc = self.accumulator()
+        return acc.result(density)
+
+    # A 'HistogramAccumulator' with the final binning, built once until the
+    # next 'fill'
+    def accumulator(self):
+        if self.final is None:
+            self.final = self.build()
+        return self.final
+
+    def build(self):
+        acc = HistogramAccumulator(self.bins, self.data_range)
+        if self.fine is None:
+            for arr, wt in self.buffer:
+                acc.fill(arr, wt)
+        else:
+            edges = self.fine.edges
+            for attr in ('sumw', 'sumw2'):
+                cum = np.concatenate([[0], np.cumsum(getattr(self.fine, attr))])
+                setattr(acc, attr, np.diff(np.interp(acc.edges, edges, cum)))
+            acc.weighted = True  # rebinned contents are fractional
+
+        # NOTE: Chunks without finite data aren't buffered, but still count
+        acc.entries = self.entries
+        return acc
+
+
+def pad_range(data_min, data_max, scale=1.05):
+    data_min = data_min*scale if data_min < 0 else data_min/scale
+    data_max = data_max/scale if data_max < 0 else data_max*scale
+    return data_min, data_max
 
 
 def gen_histo(array, bins=200, scale=1.05, data_range=None, **kwargs):
     if data_range is None:
-        data_min = array.min()
-        data_max = array.max()
+        data_range = pad_range(array.min(), array.max(), scale)
+
+    # NOTE: Non-uniform bins, other options and non-float64 inputs, whose
+    #       edges/sums 'np.histogram' keeps in their own dtype, are left to
+    #       'np.histogram'
+    weights = kwargs.get('weights')
+    if not isinstance(bins, (int, np.integer)) or \
+            set(kwargs) - {'weights', 'density'} or \
+            np.asarray(array).dtype != np.float64 or \
+            (weights is not None and np.asarray(weights).dtype != np.float64):
+        return np.histogram(array, bins, data_range, **kwargs)
+
+    return HistogramAccumulator(bins, data_range).fill(
+        array, weights).result(kwargs.get('density', False))
+
+
+# Fill a histogram from an iterable of array chunks, with an optional iterable
+# of weight chunks, in a single pass. Without 'data_range', the range is found
+# from the data, see 'AutoRangeAccumulator'.
+def gen_histo_stream(arrays, bins=200, data_range=None, weights=None,
+                     density=False, scale=1.05):
+    if data_range is None:
+        acc = AutoRangeAccumulator(bins, scale)
+    else:
+        acc = HistogramAccumulator(bins, data_range)
+    weights = [] if weights is None else weights
+
+    for arr, wt in zip_longest(arrays, weights):
+        acc.fill(arr, wt)
+
+    return acc.result(density)
+
+
+# Evaluate 'exprs' on a ntuple/tree, either all at once or in chunks of
+# 'step_size'. Yields dicts of {expr: result}.
+def eval_chunks(ntp, tree, exprs, step_size=None, **kwargs):
+    if step_size is None:
+        yield JobPlanner(ntp, tree, exprs, **kwargs).run()
+        return
+
+    exe = BooleanEvaluator(ntp, tree, **kwargs)
+    for result in exe.iter_eval(exprs, step_size):
+        yield dict(zip(exprs, result))
+
+
+# A histogram of 'var' for candidates passing 'cut', weighted by 'weight'.
+# Without a 'data_range', it's found from the data, as in 'gen_histo'.
+@dataclass
+class HistoSpec:
+    var: str
+    cut: Optional[str] = None
+    weight: Optional[str] = None
+    bins: int = 200
+    data_range: Optional[Tuple[float, float]] = None
+    scale: float = 1.05
+
+    @property
+    def exprs(self):
+        return [e for e in (self.var, self.cut, self.weight)
+                if e and e != 'None']
+
+    def accumulator(self, buffer_size=AUTO_RANGE_BUFFER):
+        if self.data_range is None:
+            return AutoRangeAccumulator(self.bins, self.scale, buffer_size)
+        return HistogramAccumulator(self.bins, self.data_range)
+
+
+# Fill histograms for many specs on the same ntuple/tree at once. Each
+# distinct expression (variable, cut or weight) is evaluated once and all
+# branches are read in a single pass, either fully or in chunks of
+# 'step_size'. Returns one accumulator per spec.
+def fill_histos(ntp, tree, specs, step_size=None, **kwargs):
+    specs = [s if isinstance(s, HistoSpec) else HistoSpec(*s) for s in specs]
+    exprs = []
+    for s in specs:
+        exprs += [e for e in s.exprs if e not in exprs]
+
+    # NOTE: Everything is in memory already, so never approximate ranges.
+    #       Otherwise the buffer budget is shared by all histograms
+    buffer_size = np.inf if step_size is None else \
+        AUTO_RANGE_BUFFER / max(sum(s.data_range is None for s in specs), 1)
+    accs = [s.accumulator(buffer_size) for s in specs]
+
+    for chunk in eval_chunks(ntp, tree, exprs, step_size, **kwargs):
+        # Cuts shared by several specs are only turned into indices once
+        selections = {}
+        for spec, acc in zip(specs, accs):
+            var = chunk[spec.var]
+            weight = chunk[spec.weight] if spec.weight in chunk else None
+            if weight is not None:
+                weight = np.broadcast_to(weight, np.shape(var))
+
+            if spec.cut in chunk:
+                if spec.cut not in selections:
+                    selections[spec.cut] = np.flatnonzero(
+                        np.broadcast_to(chunk[spec.cut], np.shape(var)))
+                sel = selections[spec.cut]
+                var = var[sel]
+                weight = None if weight is None else weight[sel]
+
+            acc.fill(var, weight)
+
+    return accs
+
+
+# ND histogram with uniform bins along each axis. Bin indices along each axis
+# are found as in 'HistogramAccumulator', then flattened so that a single
+# 'np.bincount' fills all dimensions at once. Only the sums of weights (and of
+# weights squared) per bin are kept, so huge inputs can be filled chunk by
+# chunk and the result takes O(bins) memory. Results are the same as
+# 'np.histogramdd', up to rounding of weighted sums.
+class HistogramND(object):
+    def __init__(self, bins, data_ranges):
+        if isinstance(bins, (int, np.integer)):
+            bins = [bins] * len(data_ranges)
+        if len(bins) != len(data_ranges):
+            raise ValueError('Need one binning per data range.')
+
+        self.axes = [HistogramAccumulator(b, r)
+                     for b, r in zip(bins, data_ranges)]
+        self.shape = tuple(int(b) for b in bins)
+        self.size = int(np.prod(self.shape))
+        self.sumw = np.zeros(self.shape)
+        self.sumw2 = np.zeros(self.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def edges(self):
+        return [ax.edges for ax in self.axes]
+
+    @property
+    def data_ranges(self):
+        return [ax.data_range for ax in self.axes]
+
+    # Flattened bin indices of entries within all ranges, and the mask of these
+    # entries
+    def bin_index(self, arrays):
+        keep = np.ones(arrays[0].size, dtype=bool)
+        for arr, ax in zip(arrays, self.axes):
+            lo, hi = ax.data_range
+            keep &= (arr >= lo) & (arr <= hi)
+
+        flat = np.zeros(np.count_nonzero(keep), dtype=np.intp)
+        for arr, ax in zip(arrays, self.axes):
+            idx, _ = ax.bin_index(arr[keep])
+            flat *= ax.bins
+            flat += idx
+        return flat, keep
+
+    def fill(self, *arrays, weights=None):
+        if len(arrays) != self.ndim:
+            raise ValueError(
+                f'Expect {self.ndim} arrays, got {len(arrays)}.')
+        arrays = [np.ravel(a) for a in arrays]
+        if len({a.size for a in arrays}) > 1:
+            raise ValueError('All arrays must have the same size.')
+        weights = None if weights is None else np.ravel(weights)
+
+        for start in range(0, arrays[0].size, HISTO_BLOCK_SIZE):
+            block = slice(start, start+HISTO_BLOCK_SIZE)
+            idx, keep = self.bin_index([a[block] for a in arrays])
+
+            if weights is None:
+                counts = np.bincount(idx, minlength=self.size)
+                self.sumw += counts.reshape(self.shape)
+                self.sumw2 += counts.reshape(self.shape)
+            else:
+                wt = weights[block][keep]
+                self.sumw += np.bincount(idx, wt, self.size).reshape(
+                    self.shape)
+                self.sumw2 += np.bincount(idx, wt*wt, self.size).reshape(
+                    self.shape)
+
+        return self
+
+    def merge(self, other):
+        if len(self.axes) != len(other.axes) or not all(
+                np.array_equal(e1, e2)
+                for e1, e2 in zip(self.edges, other.edges)):
+            raise ValueError('Only histograms with the same binning merge.')
+
+        self.sumw += other.sumw
+        self.sumw2 += other.sumw2
+        return self
+
+    @property
+    def errors(self):
+        return np.sqrt(self.sumw2)
+
+    # (histo, edges), same as 'np.histogramdd'
+    def result(self, density=False):
+        if not density:
+            return self.sumw.copy(), self.edges
+
+        histo = self.sumw
+        for i, edges in enumerate(self.edges):
+            shape = [1] * self.ndim
+            shape[i] = edges.size - 1
+            histo = histo / np.diff(edges).reshape(shape)
+        return histo / self.sumw.sum(), self.edges
+
+
+# Fill an ND histogram of 'variables' for candidates passing 'cut', weighted
+# by 'weight'. Missing data ranges are found from the data, as in
+# 'gen_histo', which is only possible when everything is read at once.
+def fill_histo_nd(ntp, tree, variables, bins=50, data_ranges=None, cut=None,
+                  weight=None, step_size=None, scale=1.05, **kwargs):
+    data_ranges = data_ranges or [None] * len(variables)
+    if step_size is not None and any(r is None for r in data_ranges):
+        raise ValueError('Data ranges are required when filling in chunks.')
+
+    exprs = []
+    for e in list(variables) + [cut, weight]:
+        if e and e != 'None' and e not in exprs:
+            exprs.append(e)
+
+    histo = None
+    for chunk in eval_chunks(ntp, tree, exprs, step_size, **kwargs):
+        arrays = np.broadcast_arrays(*[chunk[v] for v in variables])
+        wt = np.broadcast_to(chunk[weight], arrays[0].shape) \
+            if weight in chunk else None
+
+        if cut in chunk:
+            sel = np.flatnonzero(np.broadcast_to(chunk[cut], arrays[0].shape))
+            arrays = [a[sel] for a in arrays]
+            wt = None if wt is None else wt[sel]
 
-        data_min = data_min*scale if data_min < 0 else data_min/scale
-        data_max = data_max/scale if data_max < 0 else data_max*scale
+        if histo is None:
+            if not arrays[0].size and any(r is None for r in data_ranges):
+                continue
+            histo = HistogramND(bins, [
+                pad_range(a.min(), a.max(), scale) if r is None else r
+                for a, r in zip(arrays, data_ranges)])
+        histo.fill(*arrays, weights=wt)
 
-        return np.histogram(array, bins, (data_min, data_max), **kwargs)
+    # NOTE: Without any selected entry, the ranges can't be found from the data
+    if histo is None:
+        if any(r is None for r in data_ranges):
+            raise ValueError(
+                'Data ranges are required when no entry is selected.')
+        histo = HistogramND(bins, data_ranges)
 
-    return np.histogram(array, bins, data_range, **kwargs)
+    return histo
 
 
 def gen_histo_stacked_baseline(histos):
@@ -1,6 +1,6 @@
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Thu Apr 14, 2022 at 03:18 AM -0400
+# Last Change: Sun Oct 18, 2026 at 01:29 PM -0400
 
 import setuptools
 import codecs
@@ -60,6 +60,10 @@ setup(
         'mplhep',
         'tabulate'
     ],
+    extras_require={
+        'numexpr': ['numexpr'],
+        'scipy': ['scipy']
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: BSD License',
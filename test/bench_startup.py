@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+#
+# Author: Yipeng Sun
+# License: BSD 2-clause
+# Last Change: Sun Oct 18, 2026 at 04:58 PM -0400
+#
+# Measure the wall time of a fresh interpreter importing (parts of)
+# pyTuplingUtils. Run with 'make benchmark'.
+
+import sys
+import subprocess
+
+from argparse import ArgumentParser
+from os.path import abspath, join, dirname
+from statistics import median
+from time import perf_counter
+
+ROOT = abspath(join(dirname(__file__), '..'))
+STATEMENTS = [
+    'pass',
+    'import pyTuplingUtils',
+    'import pyTuplingUtils.io',
+    'from pyTuplingUtils.boolean.syntax import boolean_parser',
+    'from pyTuplingUtils.boolean.eval import BooleanEvaluator',
+    'import pyTuplingUtils.plot',
+]
+
+
+def time_statement(stmt, repeat):
+    cmd = [sys.executable, '-c', f'import sys; sys.path.insert(0, {ROOT!r}); '
+           + stmt]
+    result = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run(cmd, check=True)
+        result.append(perf_counter() - start)
+    return median(result)
+
+
+def parse_input():
+    parser = ArgumentParser(description='benchmark package import times.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of runs per statement.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_input()
+    for stmt in STATEMENTS:
+        print(f'{time_statement(stmt, args.repeat)*1000:8.1f} ms  {stmt}')
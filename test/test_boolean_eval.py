@@ -2,9 +2,10 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Wed Feb 16, 2022 at 04:16 PM -0500
+# Last Change: Sun Oct 18, 2026 at 11:45 PM -0400
 
 import unittest
+import pickle
 import os.path as osp
 import numpy as np
 
@@ -12,6 +13,7 @@ from context import pyTuplingUtils as ptu
 from context import pwd
 
 evaluator = ptu.boolean.eval.BooleanEvaluator
+MEMO_SIZE = ptu.boolean.eval.MEMO_SIZE
 rb = ptu.io.read_branch
 
 
@@ -151,5 +153,396 @@ class FunctionCallTest(unittest.TestCase):
         self.assertTrue(self.exe.eval('abs(abs(pi+2)*e) > abs(ONE()+e)'))
 
 
+class IterEvalTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    exe = evaluator(ntp, tree)
+
+    def test_iter_eval_single(self):
+        chunks = list(self.exe.iter_eval('Y_M < 5000', 100))
+
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(np.array_equal(
+            np.concatenate(chunks), self.exe.eval('Y_M < 5000')))
+
+    def test_iter_eval_multi(self):
+        exprs = ['Y_M', 'abs(Y_PT - Y_P) > 1000 & muplus_isMuon']
+        chunks = list(self.exe.iter_eval(exprs, 100))
+
+        for idx, e in enumerate(exprs):
+            self.assertTrue(np.array_equal(
+                np.concatenate([c[idx] for c in chunks]), self.exe.eval(e)))
+
+    def test_iter_eval_no_branch(self):
+        with self.assertRaises(ValueError):
+            list(self.exe.iter_eval(['1', 'GeV > 2'], 100))
+
+
+@unittest.skipIf(ptu.boolean.eval.numexpr is None, 'numexpr not installed')
+class NumexprTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    exe = evaluator(ntp, tree, memo_size=0)
+    exe_ne = evaluator(ntp, tree, memo_size=0, backend='numexpr')
+
+    def assert_lowered(self, expr, lowered=True):
+        tree = self.exe_ne.parse(expr)
+        self.exe_ne.load(self.exe_ne.find_vars(tree))
+
+        if lowered:
+            ptu.boolean.eval.eval_numexpr(tree, self.exe_ne.transformer)
+        else:
+            with self.assertRaises(Exception):
+                ptu.boolean.eval.eval_numexpr(tree, self.exe_ne.transformer)
+
+        self.assertTrue(np.allclose(
+            self.exe_ne.eval(expr), self.exe.eval(expr), equal_nan=True))
+
+    def test_numexpr_bool(self):
+        self.assert_lowered('Y_M < 5280 & muplus_isMuon | !Kplus_Hlt1Phys_Dec')
+        self.assert_lowered('ETA(Y_P, Y_PZ) > 2 & GT(Y_PT, 1000)')
+
+    def test_numexpr_arith(self):
+        self.assert_lowered('-pi*GeV + abs(-Y_PT)')
+        self.assert_lowered(
+            'LOG10pp(Y_PX, Y_PY, Y_PZ, muplus_PX, muplus_PY, muplus_PZ)')
+
+    def test_numexpr_fallback(self):
+        self.assert_lowered('muplus_isMuon & 1', False)  # bitwise in numexpr
+        self.assert_lowered('eventNumber * 2', False)  # uint64
+        self.assertEqual(self.exe_ne.eval('abs(-1-3*8)'), 25)
+
+    def test_numexpr_narrow_dtypes(self):
+        branches = {
+            'x': np.array([0.1, 0.15, 0.3], dtype=np.float32),
+            'i': np.array([-2, 3, 4], dtype=np.int32),
+            's': np.array([-2, 3, 4], dtype=np.int16),
+        }
+
+        for expr in ['x > 0.1', 'x <= 0.3', 'x * 2', 'abs(i)', 's + 1',
+                     'i * 2 > 3 & i < 4']:
+            ref = evaluator(None, None, branches=dict(branches)).eval(expr)
+            result = evaluator(None, None, branches=dict(branches),
+                               backend='numexpr').eval(expr)
+
+            self.assertEqual(result.dtype, ref.dtype)
+            self.assertTrue(np.array_equal(result, ref))
+
+    def test_numexpr_user_func(self):
+        known_func = dict(ptu.boolean.const.KNOWN_FUNC)
+        known_func['abs'] = lambda x: -x
+        exe = evaluator(self.ntp, self.tree, backend='numexpr',
+                        known_func=known_func)
+
+        self.assertTrue(np.array_equal(exe.eval('abs(Y_PT)'),
+                                       -self.exe.eval('Y_PT')))
+
+
+class PreloadTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+
+    def test_preload(self):
+        exe = evaluator(self.ntp, self.tree)
+        exe.preload(['Y_M < 5280', 'muplus_isMuon & Y_PT > GeV'])
+
+        for br in ['Y_M', 'Y_PT', 'muplus_isMuon']:
+            self.assertIn(br, exe.transformer.cache)
+        self.assertNotIn('GeV', exe.find_vars(exe.parse('Y_PT > GeV')))
+
+    def test_eval_cached(self):
+        exe = evaluator(self.ntp, self.tree)
+        exe.preload(['Y_M'])
+        y_m = exe.transformer.cache['Y_M']
+
+        exe.eval('Y_M < 5280 & Y_PT > 0')
+        self.assertIs(exe.transformer.cache['Y_M'], y_m)
+        self.assertIn('Y_PT', exe.transformer.cache)
+
+    def test_parse_once(self):
+        parse = ptu.boolean.eval.parse_normalized_expr
+        parse.cache_clear()
+
+        exe = evaluator(self.ntp, self.tree)
+        exe.preload(['Y_M  < 5280', 'Y_PT > GeV'])
+        exe.eval('Y_M < 5280')
+        exe.eval(' Y_PT >  GeV')
+        self.assertEqual(parse.cache_info().misses, 2)
+
+        exe = evaluator(self.ntp, self.tree, optimize=True)
+        self.assertIs(exe.parse('Y_PT > GeV'), exe.parse('Y_PT >  GeV'))
+        self.assertEqual(parse.cache_info().misses, 2)
+
+
+class CompileTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    exe = evaluator(ntp, tree)
+
+    def assert_same_as_eval(self, expr):
+        func = self.exe.compile(expr)
+        branches = ptu.io.read_branches_dict(self.ntp, self.tree, func.vars)
+        self.assertTrue(np.array_equal(func(branches), self.exe.eval(expr)))
+
+    def test_compile_scalar(self):
+        self.assertEqual(self.exe.compile('3*(pi+3)/(GeV-2)')({}),
+                         self.exe.eval('3*(pi+3)/(GeV-2)'))
+        self.assertEqual(self.exe.compile('-(-1)')({}), 1)
+        self.assertFalse(self.exe.compile('!true | false & true')({}))
+
+    def test_compile_branches(self):
+        self.assert_same_as_eval('Y_M < 5280 & muplus_isMuon | !Kplus_Hlt1Phys_Dec')
+        self.assert_same_as_eval('abs(-Y_PT + PDG_M_B0) / GeV')
+        self.assert_same_as_eval('NORM2(Y_PX, Y_PY) >= Y_PT')
+
+    def test_compile_vars(self):
+        func = self.exe.compile('Y_PX*Y_PX + Y_PY*Y_PY > GeV')
+        self.assertEqual(func.vars, ['Y_PX', 'Y_PY'])
+
+    def test_compile_cache(self):
+        func = self.exe.compile('Y_M  < 5280\n& muplus_isMuon')
+        self.assertIs(func, self.exe.compile('Y_M < 5280 & muplus_isMuon'))
+
+    def test_compile_pickle(self):
+        func = self.exe.compile('Y_M < 5280')
+        self.assertIs(pickle.loads(pickle.dumps(func)), func)
+
+        exe = evaluator(self.ntp, self.tree, known_symb={'g': 9.8})
+        func = pickle.loads(pickle.dumps(exe.compile('2*g')))
+        self.assertEqual(func({}), 19.6)
+
+
+class MemoTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+
+    def test_memo_commutative(self):
+        exe = evaluator(self.ntp, self.tree, memo_size=MEMO_SIZE)
+        ref = exe.eval('Y_M < 5280 & muplus_isMuon')
+
+        self.assertEqual((exe.memo.hits, exe.memo.misses), (0, 2))
+        self.assertTrue(np.array_equal(
+            exe.eval('muplus_isMuon & Y_M < 5280'), ref))
+        self.assertEqual((exe.memo.hits, exe.memo.misses), (1, 2))
+
+    def test_memo_sub_expr(self):
+        exe = evaluator(self.ntp, self.tree, memo_size=MEMO_SIZE)
+        func = 'LOG10pp(Y_PX, Y_PY, Y_PZ, muplus_PX, muplus_PY, muplus_PZ)'
+        exe.eval(f'{func} > -2')
+        exe.eval(f'Y_M < 5280 & {func} < 0')
+
+        self.assertEqual(exe.memo.hits, 1)
+        self.assertEqual(len(exe.memo), 5)
+
+    def test_memo_disabled(self):
+        exe = evaluator(self.ntp, self.tree)
+        self.assertIsNone(exe.memo)
+        self.assertEqual(exe.eval('abs(-1)'), 1)
+
+    def test_memo_read_only(self):
+        exe = evaluator(self.ntp, self.tree, memo_size=MEMO_SIZE)
+        ref = exe.eval('Y_PT > 3000').sum()
+
+        with self.assertRaises(ValueError):
+            exe.eval('Y_PT > 3000')[:] = False
+        self.assertEqual(exe.eval('Y_PT > 3000').sum(), ref)
+
+    def test_memo_lru(self):
+        memo = ptu.boolean.eval.MemoCache(4000)
+        memo['a'] = np.zeros(200)
+        memo['b'] = np.zeros(200)
+        memo['a']
+        memo['c'] = np.zeros(200)
+
+        self.assertEqual(list(memo.data), ['a', 'c'])
+        self.assertEqual(memo.size, 3200)
+        with self.assertRaises(KeyError):
+            memo['b']
+        self.assertEqual((memo.hits, memo.misses), (1, 1))
+
+
+class LazyBranchesTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+
+    def test_short_circuit(self):
+        lazy = ptu.io.LazyBranches(self.ntp, self.tree)
+        exe = evaluator(self.ntp, self.tree, branches=lazy)
+
+        result = exe.eval('Y_PT < 0 & Y_M > 0')
+        self.assertEqual(result.shape, (342,))
+        self.assertFalse(result.any())
+        self.assertEqual(list(lazy.data), ['Y_PT'])
+
+        self.assertTrue(exe.eval('Y_PT > 0 | Y_M > 0').all())
+        self.assertEqual(lazy.reads, 1)
+
+    def test_same_as_eager(self):
+        lazy = ptu.io.LazyBranches(self.ntp, self.tree)
+        exe = evaluator(self.ntp, self.tree, branches=lazy)
+        ref = evaluator(self.ntp, self.tree)
+        expr = 'Y_PT > 3000 & Y_M > 5280 | muplus_isMuon'
+
+        self.assertTrue(np.array_equal(exe.eval(expr), ref.eval(expr)))
+        self.assertEqual(exe.eval('GeV'), 1e3)
+
+    def test_eviction(self):
+        lazy = ptu.io.LazyBranches(self.ntp, self.tree, max_size=3000)
+        for br in ['Y_M', 'Y_PT', 'Y_M']:
+            lazy[br]
+
+        self.assertEqual(list(lazy.data), ['Y_M'])
+        self.assertEqual(lazy.reads, 3)
+
+
+class PreloadedBranchesTest(unittest.TestCase):
+    def test_caller_dict_untouched(self):
+        branches = {'x': np.arange(6), 'y': np.zeros(6, dtype=bool)}
+        exe = evaluator(None, None, branches=branches)
+
+        self.assertTrue(np.array_equal(exe.eval('x > GeV / 500'),
+                                       np.arange(6) > 2))
+        self.assertEqual(list(branches), ['x', 'y'])
+
+    def test_short_circuit_copy(self):
+        branches = {'x': np.arange(6), 'y': np.zeros(6, dtype=bool)}
+        exe = evaluator(None, None, branches=branches)
+
+        result = exe.eval('y & x > 2')
+        self.assertIsNot(result, branches['y'])
+        self.assertFalse(result.any())
+
+        result[:] = True
+        self.assertFalse(branches['y'].any())
+        self.assertIsNot(exe.eval('!y | x > 2'), exe.eval('!y | x > 2'))
+
+
+class ChainTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    exprs = [
+        'Y_PT > 3000 & Y_M > 5280 & muplus_isMuon',
+        'Y_PT < 2000 | Y_M > 5300 | !muplus_isMuon & Y_PT > 5000',
+        '(Y_PT > 3000 | Y_M > 5280) & abs(Y_M - PDG_M_B0) < 50 & true',
+        'Y_PT > 0 & 1',
+    ]
+
+    def test_same_as_unoptimized(self):
+        exe = evaluator(self.ntp, self.tree, optimize=True)
+        ref = evaluator(self.ntp, self.tree)
+
+        for expr in self.exprs:
+            self.assertTrue(np.array_equal(exe.eval(expr), ref.eval(expr)))
+        self.assertFalse(exe.eval('true & false'))
+
+    def test_multi_dim(self):
+        branches = {'x': np.arange(12).reshape(6, 2),
+                    'y': np.arange(12, 0, -1).reshape(6, 2)}
+        exe = evaluator(None, None, branches=dict(branches), optimize=True)
+        ref = evaluator(None, None, branches=dict(branches))
+
+        for expr in ['x > 3 & y < 9', 'x > 3 | y < 9 | x < 1']:
+            result = exe.eval(expr)
+            self.assertEqual(result.shape, (6, 2))
+            self.assertTrue(np.array_equal(result, ref.eval(expr)))
+
+    def test_flatten(self):
+        tree = ptu.boolean.syntax.boolean_parser.parse('a & (b & c) & (d | e)')
+        terms = ptu.boolean.optimize.flatten_chain(tree)
+
+        self.assertEqual([t.data for t in terms], ['var', 'var', 'var', 'orop'])
+
+    def test_order(self):
+        exe = evaluator(self.ntp, self.tree, optimize=True)
+        exe.preload(['Y_PT'])
+        terms = [(exe.parse(e), ['Y_PT']) for e in ['Y_PT > 0', 'Y_PT < 0']]
+
+        ordered = exe.chains.order('andop', terms, exe.transformer.cache, 342)
+        self.assertIs(ordered[0], terms[1])
+
+        ordered = exe.chains.order('orop', terms, exe.transformer.cache, 342)
+        self.assertIs(ordered[0], terms[0])
+
+
+class SimplifyTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    exe = evaluator(ntp, tree, optimize=True)
+
+    def optimized(self, expr):
+        return ptu.boolean.optimize.to_expr(self.exe.optimized(expr))
+
+    def test_fold(self):
+        self.assertEqual(self.optimized('Y_M > PDG_M_B0 * 1.0 / GeV'),
+                         '(Y_M > 5.2796400000000006)')
+        self.assertEqual(self.optimized('sqrt(4) + ONE() - -2 + Y_M'),
+                         '(5.0 + Y_M)')
+        # Errors are left for the evaluation
+        self.assertEqual(self.optimized('log(0) + Y_M'), '(log(0) + Y_M)')
+
+    def test_drop_identity(self):
+        self.assertEqual(
+            self.optimized('true & Y_PT > 3000 & (false | GT(Y_M, 5280))'),
+            '((Y_PT > 3000) & GT(Y_M, 5280))')
+        # Non-boolean operands are kept
+        self.assertEqual(self.optimized('true & Y_M'), '(true & Y_M)')
+
+    def test_drop_identity_user_func(self):
+        known_func = dict(ptu.boolean.const.KNOWN_FUNC)
+        known_func['GT'] = lambda x, y: x - y
+        exe = evaluator(self.ntp, self.tree, optimize=True,
+                        known_func=known_func)
+        ref = evaluator(self.ntp, self.tree, known_func=known_func)
+
+        expr = 'false | GT(Y_M, 5280)'
+        self.assertEqual(ptu.boolean.optimize.to_expr(exe.optimized(expr)),
+                         '(false | GT(Y_M, 5280))')
+        self.assertTrue(np.array_equal(exe.eval(expr), ref.eval(expr)))
+
+    def test_same_as_unoptimized(self):
+        ref = evaluator(self.ntp, self.tree)
+        for expr in ['Y_M * 1.0 / GeV > PDG_M_B0 * 1.0 / GeV',
+                     'true & Y_PT > 3000 & (false | Y_M > 5280)',
+                     'abs(Y_M - PDG_M_B0) + abs(Y_M - PDG_M_B0)']:
+            self.assertTrue(np.array_equal(self.exe.eval(expr),
+                                           ref.eval(expr)))
+
+    def test_common_subexpr(self):
+        calls = []
+        known_func = dict(ptu.boolean.const.KNOWN_FUNC)
+        known_func['CNT'] = lambda x: calls.append(x) or x
+
+        exe = evaluator(self.ntp, self.tree, memo_size=0, optimize=True,
+                        known_func=known_func)
+        exe.eval('CNT(Y_M) + CNT(Y_M)')
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(exe.transformer.common_results, {})
+
+
+class JobPlannerTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    exprs = ['Y_PT', 'Y_M / GeV', 'Y_M > 5000 & muplus_isMuon', None, 'None']
+
+    def test_run(self):
+        planner = ptu.boolean.eval.JobPlanner(self.ntp, self.tree, self.exprs)
+        ref = evaluator(self.ntp, self.tree)
+
+        self.assertEqual(planner.branches, ['Y_PT', 'Y_M', 'muplus_isMuon'])
+        results = planner.run()
+        self.assertEqual(list(results), self.exprs[:3])
+        for expr, val in results.items():
+            self.assertTrue(np.array_equal(val, ref.eval(expr)))
+
+    def test_entry_range(self):
+        planner = ptu.boolean.eval.JobPlanner(
+            self.ntp, self.tree, self.exprs, entry_start=10, entry_stop=20)
+        ref = evaluator(self.ntp, self.tree)
+
+        for expr, val in planner.run().items():
+            self.assertTrue(np.array_equal(val, ref.eval(expr)[10:20]))
+
+
 if __name__ == '__main__':
     unittest.main()
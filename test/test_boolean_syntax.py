@@ -2,9 +2,13 @@
 #
 # Authorop: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Thu Jun 18, 2020 at 02:47 AM +0800
+# Last Change: Sun Oct 18, 2026 at 10:45 PM -0400
 
 import unittest
+import os
+import os.path as osp
+
+from tempfile import TemporaryDirectory
 
 from context import pyTuplingUtils as ptu
 
@@ -277,5 +281,23 @@ class FunctionCallTest(unittest.TestCase):
         )
 
 
+class ParserCacheTest(unittest.TestCase):
+    def test_private_dir(self):
+        with TemporaryDirectory() as tmp:
+            cache_dir = osp.join(tmp, 'cache')
+            path = ptu.boolean.syntax.parser_cache_path(cache_dir)
+
+            self.assertEqual(osp.dirname(path), cache_dir)
+            self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+
+    def test_shared_dir(self):
+        with TemporaryDirectory() as tmp:
+            os.chmod(tmp, 0o777)
+            self.assertIsNone(ptu.boolean.syntax.parser_cache_path(tmp))
+
+    def test_not_temp_dir(self):
+        self.assertNotIn('.lark_cache_', ptu.boolean.syntax.CACHE_PATH or '')
+
+
 if __name__ == '__main__':
     unittest.main()
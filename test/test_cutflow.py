@@ -2,10 +2,11 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Fri May 01, 2020 at 07:03 PM +0800
+# Last Change: Sun Oct 18, 2026 at 10:05 PM -0400
 
 import unittest
 import os.path as osp
+import numpy as np
 
 from context import pyTuplingUtils as ptu
 from context import pwd
@@ -56,6 +57,127 @@ class CutflowTest(unittest.TestCase):
         self.assertEqual(result['Dst_2010_minus_L0HadronDecision_TOS & Y_L0ElectronDecision_TIS']['input'], 85)
         self.assertEqual(result['Dst_2010_minus_L0HadronDecision_TOS & Y_L0ElectronDecision_TIS']['output'], 10)
 
+    def test_cutflow_packed(self):
+        rules = [
+            rule('Dst_2010_minus_L0HadronDecision_TOS'),
+            rule('Y_L0MuonDecision_TIS', key='Mu'),
+            rule('Y_L0ElectronDecision_TIS', compare_to=0),
+            rule('muplus_isMuon', compare_to='r:-2'),
+        ]
+        gen = cfg(self.ntp_path, self.tree, rules, 2333)
+
+        self.assertEqual(gen.do(pack=True), gen.do())
+        self.assertEqual(gen.do()['Y_L0ElectronDecision_TIS']['output'], 10)
+        self.assertEqual(gen.do()['muplus_isMuon']['input'], 8)
+
+    def test_cutflow_debug(self):
+        rules = [rule('muplus_isMuon'), rule('Y_M < 5280')]
+
+        gen = cfg(self.ntp_path, self.tree, rules, 2333)
+        gen.do()
+        self.assertEqual(gen.debug_raw_output, [])
+
+        gen = cfg(self.ntp_path, self.tree, rules, 2333, debug=True)
+        gen.do()
+        self.assertEqual(len(gen.debug_raw_output), 2)
+        self.assertEqual(gen.debug_raw_output[1].size, 342)
+
+    def test_cutflow_weighted(self):
+        rules = [
+            rule('muplus_L0Global_TIS & (Y_L0Global_TIS | Dst_2010_minus_L0HadronDecision_TOS)', key='L0'),
+            rule('muplus_isMuon & muplus_PIDmu > 2', key='PID'),
+        ]
+        gen = cfg(self.ntp_path, self.tree, rules, 342)
+        counter = ptu.cutflow.CutflowWeightedCounter('Y_PT / GeV')
+
+        result = gen.do(counter)
+        self.assertEqual(gen.do_stream(counter, step_size=50), result)
+
+        pt = self.exe.eval('Y_PT / GeV')
+        mask = self.exe.eval('muplus_L0Global_TIS & (Y_L0Global_TIS | Dst_2010_minus_L0HadronDecision_TOS) & muplus_isMuon & muplus_PIDmu > 2')
+        self.assertAlmostEqual(result['PID']['output'], pt[mask].sum())
+        self.assertAlmostEqual(result['PID']['output_sumw2'],
+                               (pt[mask]**2).sum())
+        self.assertEqual(result['PID']['input_sumw2'],
+                         result['L0']['output_sumw2'])
+
+    def test_cutflow_efficiency(self):
+        rules = [
+            rule('muplus_L0Global_TIS & (Y_L0Global_TIS | Dst_2010_minus_L0HadronDecision_TOS)', key='L0'),
+            rule('muplus_isMuon & muplus_PIDmu > 2', key='PID'),
+        ]
+        gen = cfg(self.ntp_path, self.tree, rules, 342)
+
+        result = gen.do(efficiency=True)['PID']
+        self.assertAlmostEqual(result['eff'], 167/176)
+        self.assertAlmostEqual(result['eff_err'],
+                               np.sqrt(167/176 * 9/176 / 176))
+
+        # Unit weights are the same as no weight at all
+        weighted = gen.do(ptu.cutflow.CutflowWeightedCounter('1'),
+                          efficiency=True)['PID']
+        self.assertAlmostEqual(weighted['eff_err'], result['eff_err'])
+
+        # Weighted efficiencies need a weighted initial number
+        init_unweighted = gen.do(efficiency=True)['L0']
+        self.assertTrue(np.isnan(gen.do(
+            ptu.cutflow.CutflowWeightedCounter('1'),
+            efficiency=True)['L0']['eff']))
+
+        gen_weighted = cfg(self.ntp_path, self.tree, rules, (342, 342))
+        init_weighted = gen_weighted.do(
+            ptu.cutflow.CutflowWeightedCounter('1'), efficiency=True)['L0']
+        self.assertEqual(init_weighted['input'], 342)
+        self.assertAlmostEqual(init_weighted['eff'], init_unweighted['eff'])
+        self.assertAlmostEqual(init_weighted['eff_err'],
+                               init_unweighted['eff_err'])
+
+        if ptu.cutflow.beta is not None:
+            self.assertLess(result['eff_low'], result['eff'])
+            self.assertGreater(result['eff_high'], result['eff'])
+            self.assertAlmostEqual(weighted['eff_low'], result['eff_low'])
+
+    def test_cutflow_stream(self):
+        rules = [
+            rule('muplus_L0Global_TIS & (Y_L0Global_TIS | Dst_2010_minus_L0HadronDecision_TOS)', key='L0'),
+            rule('muplus_isMuon & muplus_PIDmu > 2', r'$\mu$ PID'),
+            rule('Y_ISOLATION_BDT < 0.15'),
+            rule('Dst_2010_minus_L0HadronDecision_TOS & Y_L0MuonDecision_TIS', compare_to=0, explicit=True),
+        ]
+        gen = cfg(self.ntp_path, self.tree, rules, 2333)
+
+        self.assertEqual(gen.do_stream(step_size=50), gen.do())
+
+    def test_cutflow_stream_uniq_events(self):
+        rules = [
+            rule('muplus_L0Global_TIS & (Y_L0Global_TIS | Dst_2010_minus_L0HadronDecision_TOS)', key='L0'),
+            rule('muplus_isMuon & muplus_PIDmu > 2'),
+            rule('Y_ISOLATION_BDT < 0.15'),
+        ]
+        ref = cfg(self.ntp_path, self.tree, rules, 2333).do(
+            ptu.cutflow.cutflow_uniq_events_outer(self.ntp_path, self.tree))
+        result = cfg(self.ntp_path, self.tree, rules, 2333).do_stream(
+            ptu.cutflow.CutflowUniqEventsCounter(), step_size=50)
+
+        self.assertEqual(result, ref)
+        self.assertEqual(result['L0']['output'], 173)
+
+    def test_cutflow_stream_workers(self):
+        rules = [
+            rule('muplus_L0Global_TIS & (Y_L0Global_TIS | Dst_2010_minus_L0HadronDecision_TOS)', key='L0'),
+            rule('muplus_isMuon & muplus_PIDmu > 2', key='PID'),
+        ]
+        gen = cfg([self.ntp_path]*3, self.tree, rules, 2333)
+
+        result = gen.do_stream(step_size=100, workers=3, pool='process')
+        self.assertEqual(result['L0']['output'], 176*3)
+        self.assertEqual(result['PID']['output'], 167*3)
+
+        result = gen.do_stream(ptu.cutflow.CutflowUniqEventsCounter(),
+                               step_size=100, workers=2)
+        self.assertEqual(result['L0']['output'], 173)
+        self.assertEqual(result['PID']['input'], 173)
+
 
 if __name__ == '__main__':
     unittest.main()
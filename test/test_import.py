@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+#
+# Author: Yipeng Sun
+# License: BSD 2-clause
+# Last Change: Sun Oct 18, 2026 at 04:58 PM -0400
+
+import unittest
+import sys
+import subprocess
+
+from context import pyTuplingUtils as ptu
+from context import pwd
+from os.path import join
+
+
+def modules_after(stmt):
+    code = f'import sys; sys.path.insert(0, {join(pwd, "..")!r}); {stmt}; ' \
+        'print(" ".join(sys.modules))'
+    return subprocess.run([sys.executable, '-c', code], check=True,
+                          capture_output=True, text=True).stdout.split()
+
+
+class LazyImportTest(unittest.TestCase):
+    def test_top_level_is_lazy(self):
+        modules = modules_after('import pyTuplingUtils')
+
+        self.assertNotIn('matplotlib', modules)
+        self.assertNotIn('lark', modules)
+        self.assertNotIn('pyTuplingUtils.io', modules)
+
+    def test_io_only(self):
+        modules = modules_after('import pyTuplingUtils.io')
+
+        self.assertNotIn('matplotlib', modules)
+        self.assertNotIn('pyTuplingUtils.boolean.syntax', modules)
+
+    def test_attribute_access(self):
+        self.assertIs(ptu.boolean.eval,
+                      sys.modules['pyTuplingUtils.boolean.eval'])
+        self.assertIn('cutflow', dir(ptu))
+        with self.assertRaises(AttributeError):
+            ptu.nonexistent
+
+
+if __name__ == '__main__':
+    unittest.main()
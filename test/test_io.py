@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#
+# Author: Yipeng Sun
+# License: BSD 2-clause
+# Last Change: Sun Oct 18, 2026 at 11:55 PM -0400
+
+import unittest
+import os
+import os.path as osp
+import numpy as np
+import uproot
+
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from context import pyTuplingUtils as ptu
+from context import pwd
+
+
+class ReadBranchesParallelTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    branches = ['Y_M', 'runNumber']
+
+    def assert_same_as_serial(self, result):
+        ref = ptu.io.read_branches_dict([self.ntp]*3, self.tree, self.branches)
+
+        self.assertEqual(list(result.keys()), self.branches)
+        for br in self.branches:
+            self.assertTrue(np.array_equal(result[br], ref[br]))
+
+    def test_thread_pool(self):
+        timing = []
+        self.assert_same_as_serial(ptu.io.read_branches_dict(
+            [self.ntp]*3, self.tree, self.branches, workers=3, timing=timing))
+
+        self.assertEqual(len(timing), 3)
+        self.assertEqual(timing[0][0], f'{self.ntp}:{self.tree}')
+
+    def test_process_pool(self):
+        self.assert_same_as_serial(ptu.io.read_branches_dict(
+            [self.ntp]*3, self.tree, self.branches, workers=2, pool='process'))
+
+    def test_single_file_timing(self):
+        timing = []
+        data = ptu.io.read_branch(self.ntp, self.tree, 'Y_M', timing=timing)
+
+        self.assertEqual(data.size, 342)
+        self.assertEqual(len(timing), 1)
+
+
+class IterBranchesTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+
+    def test_iter_branch(self):
+        chunks = list(ptu.io.iter_branch(self.ntp, self.tree, 'Y_M', 100))
+
+        self.assertEqual([c.size for c in chunks], [100, 100, 100, 42])
+        self.assertTrue(np.array_equal(
+            np.concatenate(chunks),
+            ptu.io.read_branch(self.ntp, self.tree, 'Y_M')))
+
+    def test_iter_branches(self):
+        branches = ['runNumber', 'eventNumber']
+        chunks = list(ptu.io.iter_branches(
+            [self.ntp, self.ntp], self.tree, branches, 200))
+
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(list(chunks[0].keys()), branches)
+
+    def test_iter_branches_opened_file(self):
+        ntp = uproot.open(self.ntp)
+        chunks = list(ptu.io.iter_branches(ntp, self.tree, ['Y_M'], 200))
+
+        self.assertEqual([c['Y_M'].size for c in chunks], [200, 142])
+
+
+class EntryRangeTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    ref = ptu.io.read_branch([ntp]*2, tree, 'Y_M')
+
+    def test_range_single_file(self):
+        data = ptu.io.read_branch(self.ntp, self.tree, 'Y_M', entry_start=100,
+                                  entry_stop=150)
+        self.assertTrue(np.array_equal(data, self.ref[100:150]))
+
+    def test_range_multi_files(self):
+        for start, stop in [(300, 400), (-50, None), (None, 10), (400, 342)]:
+            data = ptu.io.read_branch([self.ntp]*2, self.tree, 'Y_M',
+                                      entry_start=start, entry_stop=stop)
+            self.assertTrue(np.array_equal(data, self.ref[start:stop]))
+
+    def test_range_iter(self):
+        chunks = list(ptu.io.iter_branch(
+            [self.ntp]*2, self.tree, 'Y_M', 100, entry_start=300,
+            entry_stop=500))
+
+        self.assertEqual([c.size for c in chunks], [42, 100, 58])
+        self.assertTrue(np.array_equal(np.concatenate(chunks),
+                                       self.ref[300:500]))
+
+    def test_split_entry_range(self):
+        spec = f'{self.ntp}:{self.tree}'
+        ranges = ptu.io.split_entry_range([spec]*3, 300, 700)
+
+        self.assertEqual(ranges, [(spec, (300, 342)), (spec, (0, 342)),
+                                  (spec, (0, 16))])
+
+
+class CutPushdownTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    ref = ptu.io.read_branches_dict([ntp]*2, tree, ['Y_M', 'Y_PT'])
+    sel = ref['Y_PT'] > 3000
+
+    def test_cut(self):
+        data = ptu.io.read_branch([self.ntp]*2, self.tree, 'Y_M',
+                                  cut='Y_PT > 3000', step_size=50)
+        self.assertTrue(np.array_equal(data, self.ref['Y_M'][self.sel]))
+
+    def test_cut_entry_range(self):
+        data = ptu.io.read_branches(
+            [self.ntp]*2, self.tree, ['Y_M', 'Y_PT'], cut='Y_PT > 3000',
+            entry_start=100, entry_stop=500, step_size=50)
+
+        self.assertTrue(np.array_equal(
+            data[0], self.ref['Y_M'][100:500][self.sel[100:500]]))
+        self.assertTrue((data[1] > 3000).all())
+
+    def test_constant_cut(self):
+        self.assertEqual(
+            ptu.io.read_branch(self.ntp, self.tree, 'Y_M', cut='true').size,
+            342)
+        self.assertEqual(
+            ptu.io.read_branch(self.ntp, self.tree, 'Y_M', cut='false').size,
+            0)
+
+    def test_cut_open_once(self):
+        with mock.patch.object(ptu.io, 'open_root',
+                               wraps=ptu.io.open_root) as opened:
+            data = ptu.io.read_branch([self.ntp]*4, self.tree, 'Y_M',
+                                      cut='Y_PT > 5000')
+
+        ref = np.tile(self.ref['Y_M'][:342], 4)[
+            np.tile(self.ref['Y_PT'][:342], 4) > 5000]
+        self.assertTrue(np.array_equal(data, ref))
+        self.assertEqual(opened.call_count, 4)
+
+
+class ClusterRangesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = TemporaryDirectory()
+        cls.ntp = osp.join(cls.tmp.name, 'baskets.root')
+        with uproot.recreate(cls.ntp) as f:
+            # One basket per 'extend'
+            f.mktree('tree', {'x': np.float64, 'y': np.int32})
+            for i in range(4):
+                f['tree'].extend({'x': np.arange(i*100, (i+1)*100, dtype=float),
+                                  'y': np.arange(100, dtype=np.int32)})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_cluster_ranges(self):
+        with uproot.open(self.ntp) as f:
+            tree = f['tree']
+            self.assertEqual(
+                ptu.io.cluster_ranges(tree, ['x', 'y'], np.array([5, 350])),
+                [(0, 100), (300, 400)])
+            self.assertEqual(
+                ptu.io.cluster_ranges(tree, ['x'], np.array([5, 150, 250])),
+                [(0, 300)])
+
+    def test_cut(self):
+        data = ptu.io.read_branches(self.ntp, 'tree', ['x', 'y'],
+                                    cut='(x < 10) | (x >= 395)', step_size=30)
+
+        self.assertTrue(np.array_equal(
+            data[0], np.concatenate([np.arange(10), np.arange(395, 400)])))
+        self.assertTrue(np.array_equal(
+            data[1], np.concatenate([np.arange(10), np.arange(95, 100)])))
+
+
+class BranchCacheTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    branches = ['Y_M', 'runNumber']
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cache = ptu.io.BranchCache(self.tmp.name)
+
+    def tearDown(self):
+        ptu.io.disable_branch_cache()
+        self.tmp.cleanup()
+
+    def test_cache_roundtrip(self):
+        ref = ptu.io.read_branches_dict(self.ntp, self.tree, self.branches)
+        first = ptu.io.read_branches_dict(
+            self.ntp, self.tree, self.branches, cache=self.cache)
+        second = ptu.io.read_branches_dict(
+            self.ntp, self.tree, self.branches, cache=self.cache)
+
+        self.assertIsInstance(second['Y_M'], np.memmap)
+        for br in self.branches:
+            self.assertTrue(np.array_equal(first[br], ref[br]))
+            self.assertTrue(np.array_equal(second[br], ref[br]))
+
+    def test_cache_multi_files(self):
+        ptu.io.enable_branch_cache(self.tmp.name)
+        data = ptu.io.read_branch([self.ntp]*2, self.tree, 'Y_M')
+
+        self.assertEqual(data.size, 684)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+
+    def test_cache_eviction(self):
+        self.cache.max_size = 4000  # enough for a single branch
+        ptu.io.read_branches_dict(
+            self.ntp, self.tree, self.branches, cache=self.cache)
+
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+
+    def test_cache_scan_once(self):
+        data = np.arange(100)
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            for br in ['a', 'b', 'c']:
+                self.cache.put(self.ntp, self.tree, br, data)
+
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(self.cache.size, sum(
+            osp.getsize(osp.join(self.tmp.name, f))
+            for f in os.listdir(self.tmp.name)))
+
+    def test_cache_utime_error(self):
+        self.cache.put(self.ntp, self.tree, 'a', np.arange(100))
+        with mock.patch('os.utime', side_effect=PermissionError):
+            data = self.cache.get(self.ntp, self.tree, 'a')
+
+        self.assertTrue(np.array_equal(data, np.arange(100)))
+
+
+class SnapshotTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    branches = ['Y_M', 'runNumber', 'eventNumber']
+    cut = 'Y_PT > 3000'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = TemporaryDirectory()
+        cls.snap = ptu.io.snapshot(cls.ntp, cls.tree, cls.branches, cls.cut,
+                                   output=cls.tmp.name, step_size=100)
+        cls.sel = ptu.io.read_branch(cls.ntp, cls.tree, 'Y_PT') > 3000
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_snapshot_roundtrip(self):
+        ref = ptu.io.read_branches_dict(self.ntp, self.tree, self.branches)
+        data = ptu.io.read_branches_dict(self.tmp.name, self.tree,
+                                         self.branches)
+
+        self.assertEqual(self.snap.num_entries, 331)
+        for br in self.branches:
+            self.assertIsInstance(data[br], np.memmap)
+            self.assertEqual(data[br].dtype, ref[br].dtype)
+            self.assertTrue(np.array_equal(data[br], ref[br][self.sel]))
+
+    def test_snapshot_iter(self):
+        chunks = list(ptu.io.iter_branch(
+            [self.tmp.name, self.ntp], self.tree, 'Y_M', 200))
+
+        self.assertEqual([c.size for c in chunks], [200, 131, 200, 142])
+
+    def test_snapshot_evaluator(self):
+        exe = ptu.boolean.eval.BooleanEvaluator(self.tmp.name, self.tree)
+        ref = ptu.boolean.eval.BooleanEvaluator(self.ntp, self.tree)
+
+        self.assertTrue(np.array_equal(
+            exe.eval('Y_M > 5280'), ref.eval('Y_M > 5280')[self.sel]))
+
+    def test_snapshot_uid(self):
+        uid = ptu.utils.extract_uid(self.tmp.name, self.tree)
+        ref = ptu.utils.extract_uid(self.ntp, self.tree,
+                                    conditional=self.sel)
+
+        self.assertTrue(np.array_equal(uid[0], ref[0]))
+
+    def test_snapshot_const(self):
+        with TemporaryDirectory() as tmp:
+            snap = ptu.io.snapshot(self.ntp, self.tree, ['1', 'Y_M'],
+                                   self.cut, output=tmp, step_size=100)
+            data = ptu.io.read_branches_dict(tmp, self.tree, ['1', 'Y_M'])
+
+            self.assertEqual(snap.num_entries, 331)
+            self.assertTrue((data['1'] == 1).all())
+            self.assertEqual(data['Y_M'].size, 331)
+
+    def test_snapshot_no_branch(self):
+        with TemporaryDirectory() as tmp:
+            with self.assertRaises(ValueError):
+                ptu.io.snapshot(self.ntp, self.tree, [], self.cut, output=tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,13 @@
 #
 # Author: Yipeng Sun
 # License: BSD 2-clause
-# Last Change: Mon Jun 14, 2021 at 03:35 AM +0200
+# Last Change: Sun Oct 18, 2026 at 10:30 PM -0400
 
 import unittest
+import numpy as np
+import os.path as osp
+
+from tempfile import TemporaryDirectory
 
 from context import pyTuplingUtils as ptu
 from context import pwd
@@ -46,3 +50,61 @@ class AxStyleTest(unittest.TestCase):
             'yerr': None,
             'test': 'test'
         }
+
+
+class PrecomputedHistoTest(unittest.TestCase):
+    rng = np.random.default_rng(42)
+    x, y = rng.normal(size=(2, 1000))
+
+    def test_hist2d(self):
+        histo, xedges, yedges = np.histogram2d(self.x, self.y, (10, 5))
+        _, ax = ptu.plot.plot_hist2d(
+            xedges, yedges, ptu.plot.ax_add_args_hist2d(bins=10),
+            histo=histo, show_legend=False)
+        _, ref_ax = ptu.plot.plot_hist2d(
+            self.x, self.y, ptu.plot.ax_add_args_hist2d(bins=(10, 5)),
+            show_legend=False)
+
+        assert np.array_equal(ax.collections[0].get_array(),
+                              ref_ax.collections[0].get_array())
+
+    def test_hexbin(self):
+        # Two clusters, with nothing in between
+        x = np.concatenate([self.x*0.2 - 2, self.x*0.2 + 2])
+        histo, xedges, yedges = np.histogram2d(x, x, 100)
+        _, ax = ptu.plot.plot_hexbin(xedges, yedges, {'gridsize': 10},
+                                     histo=histo, show_legend=False)
+        hexagons = ax.collections[0].get_array()
+
+        assert hexagons.sum() == x.size
+        assert (hexagons > 0).all()
+
+
+class RenderPlotsTest(unittest.TestCase):
+    rng = np.random.default_rng(42)
+    histo, bins = np.histogram(rng.normal(size=1000), 20)
+
+    def gen_specs(self, path):
+        top = [('histo', (self.bins, self.histo,
+                          ptu.plot.ax_add_args_histo('data', 'black'))),
+               ('step', (self.bins, self.histo,
+                         ptu.plot.ax_add_args_step('ref', 'red')))]
+        bot = [('errorbar', (self.bins, np.ones(self.histo.size),
+                             ptu.plot.ax_add_args_errorbar('ratio', 'black')))]
+
+        return [
+            ptu.plot.PlotSpec(osp.join(path, 'top.png'), top,
+                              kwargs={'xlabel': 'x'}),
+            ptu.plot.PlotSpec(osp.join(path, 'top_bot.pdf'), top, bot,
+                              kwargs={'ax2_ylabel': 'ratio'}),
+        ]
+
+    def test_render(self):
+        for workers in [None, 2]:
+            with TemporaryDirectory() as tmp:
+                specs = self.gen_specs(tmp)
+                timing = ptu.plot.render_plots(specs, workers, style=None)
+
+                assert [t[0] for t in timing] == [s.output for s in specs]
+                assert all(t[1] > 0 for t in timing)
+                assert all(osp.isfile(s.output) for s in specs)
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+#
+# Author: Yipeng Sun
+# License: BSD 2-clause
+# Last Change: Mon Oct 19, 2026 at 12:05 AM -0400
+
+import unittest
+import os.path as osp
+import numpy as np
+
+from tempfile import TemporaryDirectory
+from context import pyTuplingUtils as ptu
+from context import pwd
+
+evaluator = ptu.boolean.eval.BooleanEvaluator
+
+
+class PackUidTest(unittest.TestCase):
+    def test_pack_uid(self):
+        uid = ptu.utils.pack_uid(np.array([1, 2], dtype=np.uint32),
+                                 np.array([3, 2**32-1], dtype=np.uint64))
+        run, event = ptu.utils.unpack_uid(uid)
+
+        self.assertEqual(uid.dtype, np.uint64)
+        self.assertEqual(run.tolist(), [1, 2])
+        self.assertEqual(event.tolist(), [3, 2**32-1])
+
+    def test_pack_uid_wide(self):
+        uid = ptu.utils.pack_uid([1, 2], [3, 2**40])
+        run, event = ptu.utils.unpack_uid(uid)
+
+        self.assertEqual(uid.dtype, ptu.utils.UID_DTYPE)
+        self.assertEqual(event.tolist(), [3, 2**40])
+
+    def test_unique_uid(self):
+        run = [2, 1, 2, 1, 2]
+        event = [5, 2**40, 5, 7, 3]
+        narrow = ptu.utils.pack_uid(run, [e % 100 for e in event])
+        wide = ptu.utils.pack_uid(run, event)
+
+        for uid in (narrow, wide):
+            _, idx, count = ptu.utils.unique_uid(uid)
+            self.assertEqual(idx.tolist(), [3, 1, 4, 0])
+            self.assertEqual(count.tolist(), [1, 1, 1, 2])
+
+    def test_intersect_uid(self):
+        uid_comm, idx1, idx2 = ptu.utils.intersect_uid(
+            ptu.utils.pack_uid([1, 2], [3, 4]),
+            ptu.utils.pack_uid([2, 5], [4, 2**40]))
+
+        self.assertEqual(ptu.utils.uid_to_str(uid_comm).tolist(), ['2-4'])
+        self.assertEqual((idx1.tolist(), idx2.tolist()), ([1], [0]))
+
+    def test_join_uid(self):
+        uid_comm, pos = ptu.utils.join_uid(
+            ptu.utils.pack_uid([1, 2, 3, 4], [1, 1, 1, 1]),
+            ptu.utils.pack_uid([2, 4, 9], [1, 1, 2**40]),
+            ptu.utils.pack_uid([0, 2, 4], [0, 1, 1]))
+
+        self.assertEqual(ptu.utils.uid_to_str(uid_comm).tolist(),
+                         ['2-1', '4-1'])
+        self.assertEqual([p.tolist() for p in pos], [[1, 3], [0, 1], [1, 2]])
+
+    def test_save_uid_match(self):
+        uid_comm = ptu.utils.pack_uid([1, 2], [3, 4])
+        idx = [np.array([0, 5]), np.array([2, 1])]
+
+        with TemporaryDirectory() as tmp:
+            path = osp.join(tmp, 'match.npz')
+            ptu.utils.save_uid_match(path, uid_comm, idx)
+            uid_loaded, idx_loaded = ptu.utils.load_uid_match(path)
+
+        self.assertTrue(np.array_equal(uid_loaded, uid_comm))
+        self.assertEqual([i.tolist() for i in idx_loaded], [[0, 5], [2, 1]])
+
+
+class ExtractUidTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+
+    def test_extract_uid(self):
+        _, _, num_of_evt, num_of_ids, num_of_dupl_ids, num_of_evt_w_dupl_id = \
+            ptu.utils.extract_uid(self.ntp, self.tree)
+
+        self.assertEqual(num_of_evt, 342)
+        self.assertEqual(num_of_ids, 331)
+        self.assertEqual(num_of_dupl_ids, 10)
+        self.assertEqual(num_of_evt_w_dupl_id, 11)
+
+    def test_extract_uid_as_str(self):
+        uid, _, *counts = ptu.utils.extract_uid(self.ntp, self.tree)
+        uid_str, _, *counts_str = ptu.utils.extract_uid(
+            self.ntp, self.tree, as_str=True)
+
+        self.assertEqual(counts, counts_str)
+        self.assertEqual(sorted(ptu.utils.uid_to_str(uid)), uid_str.tolist())
+
+    def test_find_common_uid(self):
+        uid_comm, idx1, idx2 = ptu.utils.find_common_uid(
+            self.ntp, self.ntp, self.tree, self.tree)
+
+        self.assertEqual(uid_comm.size, 331)
+        self.assertTrue(np.array_equal(idx1, idx2))
+
+    def test_find_common_uid_multi(self):
+        uid_comm, idx = ptu.utils.find_common_uid_multi(
+            [self.ntp]*3, self.tree)
+        ref = ptu.utils.find_common_uid(
+            self.ntp, self.ntp, self.tree, self.tree)
+
+        self.assertEqual(len(idx), 3)
+        self.assertTrue(np.array_equal(uid_comm, ref[0]))
+        for i in idx:
+            self.assertTrue(np.array_equal(i, ref[1]))
+
+    def test_extract_uid_stream(self):
+        cut = 'muplus_PIDmu > 2'
+        ref = ptu.utils.extract_uid(
+            self.ntp, self.tree,
+            conditional=evaluator(self.ntp, self.tree).eval(cut))
+        result = ptu.utils.extract_uid_stream(
+            self.ntp, self.tree, cut=cut, step_size=50)
+
+        self.assertTrue(np.array_equal(ref[0], result[0]))
+        self.assertTrue(np.array_equal(ref[1], result[1]))
+        self.assertEqual(ref[2:], result[2:])
+
+    def test_extract_uid_stream_dup_chunks(self):
+        run, event = ptu.io.read_branches(
+            [self.ntp, self.ntp], self.tree, ('runNumber', 'eventNumber'))
+        ref = ptu.utils.extract_uid(
+            None, None, run_array=run, event_array=event)
+        result = ptu.utils.extract_uid_stream(
+            [self.ntp, self.ntp], self.tree, step_size=100)
+
+        self.assertTrue(np.array_equal(ref[0], result[0]))
+        self.assertTrue(np.array_equal(ref[1], result[1]))
+        self.assertEqual(ref[2:], result[2:])
+
+    def test_count_uid_stream(self):
+        self.assertEqual(
+            ptu.utils.count_uid_stream(self.ntp, self.tree, step_size=50),
+            (342, 331, 10, 11))
+        self.assertEqual(
+            ptu.utils.count_uid_stream(
+                [self.ntp, self.ntp], self.tree, step_size=100, partitions=7),
+            (684, 331, 331, 353))
+
+    def test_count_uid_stream_cut(self):
+        cut = 'muplus_PIDmu > 2'
+        ref = ptu.utils.extract_uid(
+            self.ntp, self.tree,
+            conditional=evaluator(self.ntp, self.tree).eval(cut))
+
+        self.assertEqual(
+            ptu.utils.count_uid_stream(self.ntp, self.tree, cut=cut),
+            ref[2:])
+
+
+class GenHistoTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+
+    def test_gen_histo_stream(self):
+        ref, ref_bins = ptu.utils.gen_histo(
+            ptu.io.read_branch(self.ntp, self.tree, 'Y_M'), 20,
+            data_range=(3000, 6000))
+        histo, bins = ptu.utils.gen_histo_stream(
+            ptu.io.iter_branch(self.ntp, self.tree, 'Y_M', 50), 20,
+            (3000, 6000))
+
+        self.assertTrue(np.allclose(ref, histo))
+        self.assertTrue(np.allclose(ref_bins, bins))
+
+    def test_gen_histo_stream_no_range(self):
+        ref, ref_bins = ptu.utils.gen_histo(
+            ptu.io.read_branch(self.ntp, self.tree, 'Y_M'), 20)
+        histo, bins = ptu.utils.gen_histo_stream(
+            ptu.io.iter_branch(self.ntp, self.tree, 'Y_M', 50), 20)
+
+        self.assertTrue(np.array_equal(ref, histo))
+        self.assertTrue(np.array_equal(ref_bins, bins))
+
+
+class HistogramAccumulatorTest(unittest.TestCase):
+    rng = np.random.default_rng(42)
+    data = np.concatenate([rng.normal(size=100000), [np.nan, -3, 3, 5]])
+    weights = rng.random(data.size)
+
+    def test_same_as_np_histogram(self):
+        for kwargs in [{}, {'weights': self.weights}, {'density': True}]:
+            ref, ref_edges = np.histogram(self.data, 50, (-3, 3), **kwargs)
+            histo, edges = ptu.utils.gen_histo(self.data, 50,
+                                               data_range=(-3, 3), **kwargs)
+
+            self.assertEqual(histo.dtype, ref.dtype)
+            self.assertTrue(np.array_equal(histo, ref))
+            self.assertTrue(np.array_equal(edges, ref_edges))
+
+    def test_same_as_np_histogram_other_dtypes(self):
+        data32 = self.data.astype(np.float32)
+        for data, kwargs in [
+                (data32, {}),
+                (data32, {'weights': self.weights.astype(np.float32)}),
+                (self.data, {'weights': np.arange(self.data.size)})]:
+            ref, ref_edges = np.histogram(data, 50, (-3, 3), **kwargs)
+            histo, edges = ptu.utils.gen_histo(data, 50, data_range=(-3, 3),
+                                               **kwargs)
+
+            self.assertEqual(histo.dtype, ref.dtype)
+            self.assertEqual(edges.dtype, ref_edges.dtype)
+            self.assertTrue(np.array_equal(histo, ref))
+            self.assertTrue(np.array_equal(edges, ref_edges))
+
+    def test_merge_chunks(self):
+        accs = [ptu.utils.HistogramAccumulator(50, (-3, 3)) for _ in range(2)]
+        for idx, (arr, wt) in enumerate(zip(
+                np.array_split(self.data, 5), np.array_split(self.weights, 5))):
+            accs[idx % 2].fill(arr, wt)
+        acc = accs[0].merge(accs[1])
+
+        ref, _ = np.histogram(self.data, 50, (-3, 3), weights=self.weights)
+        ref_sumw2, _ = np.histogram(self.data, 50, (-3, 3),
+                                    weights=self.weights**2)
+        self.assertTrue(np.allclose(acc.result()[0], ref))
+        self.assertTrue(np.allclose(acc.errors, np.sqrt(ref_sumw2)))
+
+    def test_auto_range_spilled(self):
+        data = np.sort(self.data[np.isfinite(self.data)])[::-1]
+        ref, ref_edges = ptu.utils.gen_histo(data, 50)
+
+        acc = ptu.utils.AutoRangeAccumulator(50, buffer_size=1000)
+        for arr in np.array_split(data, 100):
+            acc.fill(arr)
+        histo, edges = acc.result()
+
+        self.assertIsNotNone(acc.fine)
+        self.assertTrue(np.array_equal(edges, ref_edges))
+        self.assertAlmostEqual(histo.sum(), ref.sum())
+        self.assertLess(np.abs(histo - ref).max(), 0.01*ref.max())
+
+    def test_auto_range_buffer_bytes(self):
+        acc = ptu.utils.AutoRangeAccumulator(50, buffer_size=8000)
+        acc.fill(self.data[:500], self.weights[:500])
+        self.assertIsNone(acc.fine)
+        acc.fill(self.data[500:1000])
+        self.assertIsNotNone(acc.fine)
+        self.assertEqual(acc.buffer, [])
+
+    def test_auto_range_result_cached(self):
+        acc = ptu.utils.AutoRangeAccumulator(50).fill(self.data[:1000])
+        self.assertIs(acc.accumulator(), acc.accumulator())
+
+        histo, _ = acc.result()
+        acc.fill(self.data[1000:2000])
+        self.assertEqual(acc.result()[0].sum(), 2*histo.sum())
+
+    def test_auto_range_no_data(self):
+        with self.assertRaises(ValueError):
+            ptu.utils.AutoRangeAccumulator().fill([np.nan]).result()
+
+    def test_merge_mismatch(self):
+        with self.assertRaises(ValueError):
+            ptu.utils.HistogramAccumulator(50, (-3, 3)).merge(
+                ptu.utils.HistogramAccumulator(50, (-3, 4)))
+
+
+class FillHistosTest(unittest.TestCase):
+    ntp = osp.join(pwd, '../samples/sample.root')
+    tree = 'TupleB0/DecayTree'
+    specs = [
+        ptu.utils.HistoSpec('Y_PT', 'Y_M > 5000', 'Y_M / GeV', 20),
+        ('Y_M', 'Y_M > 5000', None, 20, (3000, 6000)),
+        ('Y_M', None, 'None', 30),
+        ('Y_PT', 'true', '2', 10),
+    ]
+
+    def ref(self, spec):
+        exe = evaluator(self.ntp, self.tree)
+        var = exe.eval(spec.var)
+        weight = exe.eval(spec.weight) if spec.weight in spec.exprs else None
+        if weight is not None:
+            weight = np.broadcast_to(weight, var.shape)
+        if spec.cut:
+            sel = np.broadcast_to(exe.eval(spec.cut), var.shape)
+            var = var[sel]
+            weight = None if weight is None else weight[sel]
+
+        return ptu.utils.gen_histo(var, spec.bins, data_range=spec.data_range,
+                                   weights=weight)
+
+    def assert_same_as_ref(self, accs):
+        self.assertEqual(len(accs), len(self.specs))
+        for spec, acc in zip(self.specs, accs):
+            spec = spec if isinstance(spec, ptu.utils.HistoSpec) else \
+                ptu.utils.HistoSpec(*spec)
+            ref, ref_edges = self.ref(spec)
+            histo, edges = acc.result()
+
+            self.assertTrue(np.allclose(histo, ref))
+            self.assertTrue(np.allclose(edges, ref_edges))
+
+    def test_fill_histos(self):
+        self.assert_same_as_ref(
+            ptu.utils.fill_histos(self.ntp, self.tree, self.specs))
+
+    def test_fill_histos_chunked(self):
+        self.assert_same_as_ref(
+            ptu.utils.fill_histos(self.ntp, self.tree, self.specs,
+                                  step_size=50))
+
+    def test_fill_histos_entries(self):
+        num_of_sel = evaluator(self.ntp, self.tree).eval('Y_M > 5000').sum()
+        for step_size in [None, 50]:
+            accs = ptu.utils.fill_histos(self.ntp, self.tree, self.specs,
+                                         step_size=step_size)
+            self.assertEqual([acc.entries for acc in accs],
+                             [num_of_sel, num_of_sel, 342, 342])
+
+
+class HistogramNDTest(unittest.TestCase):
+    rng = np.random.default_rng(42)
+    data = rng.normal(size=(3, 100000))
+    data[0, 0] = np.nan
+    weights = rng.random(data.shape[1])
+    bins = (10, 20, 30)
+    data_ranges = [(-3, 3), (-2, 3), (-3, 2)]
+
+    def test_same_as_np_histogramdd(self):
+        for kwargs in [{}, {'weights': self.weights}, {'density': True}]:
+            ref, ref_edges = np.histogramdd(
+                tuple(self.data), self.bins, self.data_ranges, **kwargs)
+            histo, edges = ptu.utils.HistogramND(
+                self.bins, self.data_ranges).fill(
+                    *self.data, weights=kwargs.get('weights')).result(
+                        kwargs.get('density', False))
+
+            self.assertTrue(np.allclose(histo, ref, rtol=1e-12, atol=0))
+            for e, ref_e in zip(edges, ref_edges):
+                self.assertTrue(np.array_equal(e, ref_e))
+
+    def test_merge_chunks(self):
+        accs = [ptu.utils.HistogramND(20, self.data_ranges[:2])
+                for _ in range(2)]
+        for idx, (arr, wt) in enumerate(zip(
+                np.array_split(self.data[:2], 5, axis=1),
+                np.array_split(self.weights, 5))):
+            accs[idx % 2].fill(*arr, weights=wt)
+        acc = accs[0].merge(accs[1])
+
+        ref, _, _ = np.histogram2d(*self.data[:2], 20, self.data_ranges[:2],
+                                   weights=self.weights**2)
+        self.assertTrue(np.allclose(acc.errors, np.sqrt(ref)))
+
+    def test_fill_mismatch(self):
+        with self.assertRaises(ValueError):
+            ptu.utils.HistogramND(10, self.data_ranges).fill(*self.data[:2])
+        with self.assertRaises(ValueError):
+            ptu.utils.HistogramND(10, self.data_ranges[:2]).merge(
+                ptu.utils.HistogramND(10, self.data_ranges[1:]))
+
+    def test_fill_histo_nd(self):
+        ntp = osp.join(pwd, '../samples/sample.root')
+        tree = 'TupleB0/DecayTree'
+        exe = evaluator(ntp, tree)
+        sel = exe.eval('Y_M > 4000')
+        x, y = exe.eval('Y_M')[sel], exe.eval('Y_PT / GeV')[sel]
+        data_ranges = [(3000, 6000), (0, 20)]
+
+        ref, _, _ = np.histogram2d(x, y, (5, 4), data_ranges,
+                                   weights=np.full(x.size, 2.))
+        for step_size in [None, 50]:
+            histo = ptu.utils.fill_histo_nd(
+                ntp, tree, ['Y_M', 'Y_PT / GeV'], (5, 4), data_ranges,
+                cut='Y_M > 4000', weight='2', step_size=step_size)
+            self.assertTrue(np.array_equal(histo.sumw, ref))
+
+        histo = ptu.utils.fill_histo_nd(ntp, tree, ['Y_M', 'Y_PT / GeV'], 5,
+                                        cut='Y_M > 4000')
+        self.assertEqual(histo.sumw.sum(), x.size)
+        self.assertEqual(histo.data_ranges[0],
+                         ptu.utils.pad_range(x.min(), x.max()))
+
+        with self.assertRaises(ValueError):
+            ptu.utils.fill_histo_nd(ntp, tree, ['Y_M', 'Y_PT'], step_size=50)
+
+    def test_fill_histo_nd_empty(self):
+        ntp = osp.join(pwd, '../samples/sample.root')
+        tree = 'TupleB0/DecayTree'
+        data_ranges = [(3000, 6000), (0, 20)]
+
+        for kwargs in [dict(cut='Y_PT < 0'),
+                       dict(step_size=50, entry_start=0, entry_stop=0)]:
+            histo = ptu.utils.fill_histo_nd(
+                ntp, tree, ['Y_M', 'Y_PT / GeV'], (5, 4), data_ranges,
+                **kwargs)
+            self.assertEqual(histo.sumw.shape, (5, 4))
+            self.assertFalse(histo.sumw.any())
+            self.assertEqual(histo.data_ranges, data_ranges)
+
+        with self.assertRaises(ValueError):
+            ptu.utils.fill_histo_nd(ntp, tree, ['Y_M', 'Y_PT'],
+                                    cut='Y_PT < 0')
+
+
+if __name__ == '__main__':
+    unittest.main()